@@ -0,0 +1,186 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+###############################################################################
+# 
+# Description : 
+#    This file implements the per frame analysis of the capture loop: the
+#    link survey (cWS_SnifferLinkSurvey) and the loss estimation
+#    (cWS_SnifferLossEstimator).
+#
+#    Without workers both run in the capture thread. With nWorkers > 0
+#    the frames are fed to a cWS_SnifferWorkerPool, whose workers parse
+#    the MAC header down to the source, sequence number and LQI, with the
+#    frame's arrival time (AnalyseFrame); a gatherer thread adds the
+#    results, in order, to the survey and the loss estimator. Channel changes are queued with the
+#    number of frames put before them, and passed to the loss estimator
+#    once those frames are analysed. Only the counters stay in the capture
+#    process, as the survey and loss report are written from there.
+#
+#    A frame failing in a worker is left out of the analysis; a dead
+#    worker stops the analysis, not the capture.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import sys, time, threading, collections
+from WS_SnifferMacHeader import ParseMacHeader, GetSourceId, MAC_FRAME_BEACON
+
+def AnalyseFrame(dataFrm, channel, arrivalTime):
+    """ worker stage: returns (channel, arrivalTime, time stamp, LQI, source,
+        sequence number, beacon), see GetSourceId for the source
+    """
+    hdr = ParseMacHeader(dataFrm.getMsdu())
+    if hdr is None: # truncated, no source
+        return (channel, arrivalTime, dataFrm.getTimeStamp(), dataFrm.getLinkQuality(), None, None, False)
+    return (channel, arrivalTime, dataFrm.getTimeStamp(), dataFrm.getLinkQuality(),
+            GetSourceId(hdr), hdr[1], hdr[0] == MAC_FRAME_BEACON)
+
+class cWS_SnifferAnalysis:
+    """ Feeds received frames to the survey and the loss estimator, either
+        may be None, directly or through a pool of worker processes.
+    """
+#==============================================================================
+    def __init__(self, survey, lossEstimator, nWorkers=0):
+        self.survey = survey
+        self.lossEstimator = lossEstimator
+        self.lock = threading.Lock() # the gatherer thread against Export()
+        self.pool = None
+        self.thread = None
+        self.nPut = 0
+        self.nDone = 0
+        self.channelChanges = collections.deque() # frames put before each change
+        self.nFailed = 0
+        self.error = None
+
+        if nWorkers > 0:
+            import WS_SnifferWorkerPool
+            self.pool = WS_SnifferWorkerPool.cWS_SnifferWorkerPool([AnalyseFrame], nWorkers)
+            self.thread = threading.Thread(target=self.GathererThread, args=(self.pool,), name="analysis")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def AddFrame(self, dataFrm, channel):
+        self.nPut += 1
+        if self.pool is None:
+            if self.error is None:
+                self.Apply(AnalyseFrame(dataFrm, channel, time.time()))
+            return
+        try:
+            self.pool.Put(dataFrm, channel)
+        except RuntimeError, err:
+            self.Stop(err)
+
+    def ChangeChannel(self):
+        """ to be called on channel changes, after the frames received before """
+        if not self.error is None:
+            return
+        self.channelChanges.append(self.nPut)
+        if self.pool is None:
+            self.lock.acquire()
+            try:
+                self.ApplyChannelChanges()
+            finally:
+                self.lock.release()
+
+    def ApplyChannelChanges(self):
+        while self.channelChanges and self.channelChanges[0] <= self.nDone:
+            self.channelChanges.popleft()
+            if not self.lossEstimator is None:
+                self.lossEstimator.ChangeChannel()
+
+    def Apply(self, result):
+        """ adds the AnalyseFrame result of the next frame, None for a failed frame """
+        self.lock.acquire()
+        try:
+            self.ApplyChannelChanges()
+            self.nDone += 1
+            if result is None:
+                return
+            channel, arrivalTime, ts, lqi, source, seq, isBeacon = result
+            if not self.survey is None:
+                self.survey.AddSample(channel, source, lqi)
+            if not self.lossEstimator is None:
+                self.lossEstimator.AddSequenceNumber(source, seq, isBeacon, ts, channel, arrivalTime)
+        finally:
+            self.lock.release()
+
+    def GathererThread(self, pool):
+        while 1:
+            try:
+                result = pool.GetResult()
+            except RuntimeError, err:
+                if pool.isAlive():
+                    self.nFailed += 1 # a failed frame, the worker carries on
+                    self.Apply(None)
+                    continue
+                self.error = self.error or err
+                break
+            if result is None:
+                break
+            self.Apply(result[0])
+
+    def Stop(self, err):
+        """ stops the analysis after a worker died, the capture carries on """
+        if self.error is None:
+            self.error = err
+            sys.stderr.write('ERROR: frame analysis stopped: %s\n' % str(err))
+            sys.stderr.flush()
+        self.pool.Terminate()
+        self.pool = None
+
+    def Flush(self):
+        """ hands the frames collected so far to the workers, e.g. when idle """
+        if not self.pool is None:
+            self.pool.Flush()
+
+    def ExportSurvey(self, sBaseName):
+        self.lock.acquire()
+        try:
+            self.survey.Export(sBaseName)
+        finally:
+            self.lock.release()
+
+    def Close(self):
+        """ waits until all frames put are analysed """
+        if not self.pool is None:
+            self.pool.Close()
+            self.thread.join()
+            self.pool.Join()
+            self.pool = None
+        elif not self.thread is None:
+            self.thread.join()
+        if self.nFailed > 0:
+            sys.stderr.write('ERROR: %d frames failed analysis\n' % self.nFailed)
+            sys.stderr.flush()
@@ -0,0 +1,369 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements a long-running capture daemon.
+#
+#    Sniffer devices are opened and configured once and kept capturing in
+#    a warm device pool (one receive thread per device). Wireshark
+#    sessions are pipe sinks attached to and detached from a running
+#    device, so starting a session neither resets the hardware nor waits
+#    for its configuration. Every session writes from its own thread through
+#    a bounded queue; records for a reader that falls behind are dropped
+#    and counted, the device and other sessions keep going.
+#
+#    The daemon is controlled through a line based text protocol on a Unix
+#    socket (posix only):
+#
+#        open <port> <channel>           add a device to the pool
+#        close <port>                    remove a device from the pool
+#        retune <port> <channel>         change the channel of a device
+#        start <port> <pipe> [encap]     attach a pipe sink (a session),
+#                                        encap 802.15.4, zepv1 or an export
+#                                        format (jsonl, csv, columns) with
+#                                        pipe naming the output file
+#        stop <sessionId>                detach a pipe sink
+#        status                          list devices and sessions
+#        shutdown                        stop the daemon
+#
+#    Every command is answered with a single line starting with OK or ERROR.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import os, stat, socket, threading, inspect, Queue, SocketServer
+import WS_SnifferAdapterFreescale
+import WS_SnifferLibPcapEncap
+import WS_SnifferExportWrapper
+
+ENCAP = dict(WS_SnifferLibPcapEncap.ENCAP)
+
+# export sinks, with the pipe name being the output file
+for exportFormat in WS_SnifferExportWrapper.EXPORT_FORMATS:
+    ENCAP[exportFormat] = (lambda fmt: lambda sFileName:
+                           WS_SnifferExportWrapper.cWS_SnifferExportWrapper(sFileName, fmt))(exportFormat)
+
+DEVICE_RX_TIMEOUT   = 0.5 # s, bounds the latency of retune/close requests
+SESSION_QUEUE_SIZE  = 4096 # records queued per session before dropping
+
+class cWS_SnifferSession:
+    """ A pipe sink attached to a device. The device thread only queues
+        records; the session thread opens the pipe and writes them, so a
+        slow reader drops its own records instead of stalling the device.
+    """
+#==============================================================================
+    def __init__(self, sessionId, device, pipeWrapper):
+        self.sessionId = sessionId
+        self.device = device
+        self.pipeWrapper = pipeWrapper
+        self.queue = Queue.Queue(SESSION_QUEUE_SIZE)
+        self.connected = False
+        self.closed = False
+        self.nRecords = 0
+        self.nDropped = 0
+        self.error = None
+
+    def Run(self):
+        """ runs in its own thread, as opening the pipe waits for Wireshark """
+        try:
+            try:
+                self.pipeWrapper.OpenPipe()
+                if self.closed:
+                    return
+                self.pipeWrapper.WriteFileHeader()
+                self.connected = True
+                self.device.Attach(self)
+                while True:
+                    record = self.queue.get()
+                    if record is None or self.closed:
+                        break
+                    self.pipeWrapper.WriteRecord(*record)
+                    self.nRecords += 1
+            except Exception, err:
+                if not self.connected:
+                    self.error = str(err) # e.g. the pipe exists, or a bad export path
+                # else for now: assume pipe closed by Wireshark
+        finally:
+            self.device.Detach(self)
+            self.closed = True
+            try:
+                self.pipeWrapper.ClosePipe()
+            except Exception:
+                pass
+
+    def WriteRecord(self, dataFrm, channel):
+        """ called on the device thread """
+        try:
+            self.queue.put_nowait((dataFrm, channel))
+        except Queue.Full:
+            self.nDropped += 1
+
+    def Close(self):
+        """ ends the session thread, also while it still waits for Wireshark """
+        if self.closed:
+            return
+        self.closed = True
+        if not self.connected and hasattr(self.pipeWrapper, "AbortOpenPipe"):
+            self.pipeWrapper.AbortOpenPipe()
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            pass # the session thread checks closed after every record
+
+    def getStatus(self):
+        if self.closed:
+            state = "closed"
+        elif self.connected:
+            state = "connected"
+        else:
+            state = "waiting"
+        status = "session %d port=%s pipe=%s state=%s records=%d dropped=%d" % (
+            self.sessionId, self.device.getPort(), self.pipeWrapper.getPipeName(), state,
+            self.nRecords, self.nDropped)
+        if not self.error is None:
+            status += " error=%s" % self.error
+        return status
+
+class cWS_SnifferDevice:
+    """ A configured sniffer device with its receive thread. All access to
+        the adapter happens on the receive thread; requests from other
+        threads are queued.
+    """
+#==============================================================================
+    def __init__(self, sPort, channel):
+        self.sPort = sPort
+        self.channel = channel
+        self.sessions = []
+        self.lock = threading.Lock()
+        self.requests = Queue.Queue()
+        self.running = True
+        self.nRecords = 0
+        self.error = None
+
+        self.snifferAdapter = WS_SnifferAdapterFreescale.cWS_SnifferWrapperMC1322x(sPort, channel, DEVICE_RX_TIMEOUT)
+        self.thread = threading.Thread(target=self.Run, name="device %s" % sPort)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def getPort(self):
+        return self.sPort
+
+    def Attach(self, session):
+        self.lock.acquire()
+        try:
+            self.sessions = self.sessions + [session]
+        finally:
+            self.lock.release()
+
+    def Detach(self, session):
+        self.lock.acquire()
+        try:
+            self.sessions = [s for s in self.sessions if s is not session]
+        finally:
+            self.lock.release()
+
+    def Retune(self, channel):
+        self.requests.put(channel)
+
+    def Close(self):
+        self.running = False
+        self.thread.join()
+        for session in self.sessions:
+            session.Close()
+        self.snifferAdapter.s.close()
+
+    def Run(self):
+        while self.running:
+            try:
+                while not self.requests.empty():
+                    self.channel = self.requests.get()
+                    self.snifferAdapter.ChangeLogicalChannel(self.channel)
+
+                dataFrm = self.snifferAdapter.RcvDataFrame()
+            except Exception, err:
+                self.error = str(err)
+                self.running = False
+                break
+
+            if not dataFrm is None:
+                self.nRecords += 1
+                for session in self.sessions: # replaced, never modified, on attach/detach
+                    session.WriteRecord(dataFrm, self.channel)
+
+    def getStatus(self):
+        status = "device %s channel=%d records=%d sessions=%d" % (self.sPort, self.channel, self.nRecords, len(self.sessions))
+        if not self.error is None:
+            status += " error=%s" % self.error
+        return status
+
+class cWS_SnifferDaemon:
+    """ Warm device pool and sessions, driven by control commands """
+#==============================================================================
+    def __init__(self):
+        self.devices = {}
+        self.sessions = {}
+        self.nextSessionId = 1
+        self.lock = threading.Lock()
+        self.server = None
+
+    def Command(self, line):
+        """ executes one control command, returns the reply line """
+        args = line.split()
+        if len(args) == 0:
+            return "ERROR empty command"
+        handler = getattr(self, "Cmd_" + args[0], None)
+        if handler is None:
+            return "ERROR unknown command '%s'" % args[0]
+        names, varargs, keywords, defaults = inspect.getargspec(handler)
+        nMax = len(names) - 1 # self
+        nMin = nMax - len(defaults or ())
+        if len(args) - 1 < nMin or len(args) - 1 > nMax:
+            return "ERROR wrong number of arguments for '%s'" % args[0]
+
+        self.lock.acquire()
+        try:
+            return "OK " + handler(*args[1:])
+        except Exception, err:
+            return "ERROR %s" % str(err)
+        finally:
+            self.lock.release()
+
+    def getDevice(self, sPort):
+        if not sPort in self.devices:
+            raise ValueError("no device on port %s" % sPort)
+        return self.devices[sPort]
+
+    def getSession(self, sessionId):
+        if not sessionId.isdigit() or not int(sessionId) in self.sessions:
+            raise ValueError("no session %s" % sessionId)
+        return self.sessions[int(sessionId)]
+
+    def Cmd_open(self, sPort, channel):
+        if sPort in self.devices:
+            raise ValueError("device on port %s already open" % sPort)
+        self.devices[sPort] = cWS_SnifferDevice(sPort, int(channel))
+        return self.devices[sPort].getStatus()
+
+    def Cmd_close(self, sPort):
+        device = self.getDevice(sPort)
+        del self.devices[sPort]
+        device.Close()
+        # including sessions still waiting for Wireshark, which are not attached
+        for sessionId, session in self.sessions.items():
+            if session.device is device:
+                del self.sessions[sessionId]
+                session.Close()
+        return "closed %s" % sPort
+
+    def Cmd_retune(self, sPort, channel):
+        self.getDevice(sPort).Retune(int(channel))
+        return "retuning %s to channel %d" % (sPort, int(channel))
+
+    def Cmd_start(self, sPort, sPipeName, encap="802.15.4"):
+        device = self.getDevice(sPort)
+        if not encap in ENCAP:
+            raise ValueError("unsupported encapsulation %s" % encap)
+        session = cWS_SnifferSession(self.nextSessionId, device, ENCAP[encap](sPipeName))
+        self.sessions[session.sessionId] = session
+        self.nextSessionId += 1
+
+        thread = threading.Thread(target=session.Run, name="session %d" % session.sessionId)
+        thread.daemon = True
+        thread.start()
+        return "session %d" % session.sessionId
+
+    def Cmd_stop(self, sessionId):
+        session = self.getSession(sessionId)
+        del self.sessions[session.sessionId]
+        session.device.Detach(session)
+        session.Close()
+        return "stopped session %d" % session.sessionId
+
+    def Cmd_status(self):
+        status = [d.getStatus() for d in self.devices.values()]
+        status += [s.getStatus() for s in self.sessions.values()]
+        # forget sessions closed by Wireshark, or failed, once reported
+        for sessionId, session in self.sessions.items():
+            if session.closed:
+                del self.sessions[sessionId]
+        return "; ".join(status)
+
+    def Cmd_shutdown(self):
+        for sPort in self.devices.keys():
+            self.Cmd_close(sPort)
+        if not self.server is None:
+            threading.Thread(target=self.server.shutdown).start()
+        return "shutting down"
+
+    def Serve(self, sSocketName):
+        daemon = self
+        class cControlHandler(SocketServer.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(daemon.Command(line.strip()) + "\n")
+                    self.wfile.flush()
+
+        if os.path.exists(sSocketName):
+            # only replace a stale socket, never a file or a running daemon
+            if not stat.S_ISSOCK(os.stat(sSocketName).st_mode):
+                raise IOError("'%s' exists and is not a socket" % sSocketName)
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    s.connect(sSocketName)
+                except socket.error:
+                    os.unlink(sSocketName) # nobody listening
+                else:
+                    raise IOError("a daemon is already listening on '%s'" % sSocketName)
+            finally:
+                s.close()
+        self.server = SocketServer.ThreadingUnixStreamServer(sSocketName, cControlHandler)
+        self.server.daemon_threads = True
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.unlink(sSocketName)
+
+def SendCommand(sSocketName, line):
+    """ sends a control command to a running daemon and returns the reply """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(sSocketName)
+        s.sendall(line + "\n")
+        f = s.makefile("r")
+        return f.readline().strip()
+    finally:
+        s.close()
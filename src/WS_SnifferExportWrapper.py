@@ -0,0 +1,218 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements an export sink writing per frame records
+#    (timestamp, channel, LQI, MSDU length, decoded MAC header fields and
+#    the raw MSDU in hex) as JSON Lines, CSV or column batches instead of
+#    libpcap. It has the same interface as the pcap wrappers, with the
+#    pipe name being the output file name.
+#
+#    WriteRecord only appends the raw frame to the current batch. Full
+#    batches are handed to a writer thread, which decodes, formats and
+#    writes them, keeping the formatting out of the capture thread.
+#
+#    With nWorkers > 0, decoding and per record formatting run in a
+#    cWS_SnifferWorkerPool instead, and the writer thread gathers the
+#    results in order.
+#
+#    The "columns" format writes one JSON object per batch, mapping each
+#    field name to the array of its values in the batch (Arrow style).
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import json, binascii, threading, Queue
+from WS_SnifferMacHeader import ParseMacHeader
+
+EXPORT_JSONL        = "jsonl"
+EXPORT_CSV          = "csv"
+EXPORT_COLUMNS      = "columns"
+EXPORT_FORMATS      = [EXPORT_JSONL, EXPORT_CSV, EXPORT_COLUMNS]
+
+EXPORT_FIELDS = ["timestamp_us", "channel", "lqi", "msdu_len", "frame_type", "seq_no",
+                 "dst_pan", "dst_addr", "src_pan", "src_addr", "msdu"]
+
+MICROS_PER_SYMBOL   = 16 # symbol duration in us
+
+def DecodeRecord(dataFrm, channel, arrivalTime=None):
+    """ returns the export fields of a frame as a list following EXPORT_FIELDS """
+    msdu = dataFrm.getMsdu()
+    hdr = ParseMacHeader(msdu)
+    if hdr is None:
+        hdr = (None, None, None, None, None, None)
+    return ([MICROS_PER_SYMBOL * dataFrm.getTimeStamp(), channel,
+             dataFrm.getLinkQuality(), dataFrm.getMsduLen()]
+            + list(hdr) + [binascii.hexlify(msdu)])
+
+def FormatJsonLine(dataFrm, channel, arrivalTime=None):
+    return json.dumps(dict(zip(EXPORT_FIELDS, DecodeRecord(dataFrm, channel)))) + "\n"
+
+def FormatCsvLine(dataFrm, channel, arrivalTime=None):
+    return ",".join(["" if v is None else str(v) for v in DecodeRecord(dataFrm, channel)]) + "\n"
+
+# per record stage of each format, run in the writer thread or the workers
+EXPORT_STAGES = {EXPORT_JSONL:   FormatJsonLine,
+                 EXPORT_CSV:     FormatCsvLine,
+                 EXPORT_COLUMNS: DecodeRecord}
+
+class cWS_SnifferExportWrapper:
+    def __init__(self, sFileName, format=EXPORT_JSONL, batchSize=256, queueSize=64, nWorkers=0):
+        assert format in EXPORT_FORMATS, "Unsupported export format %s" % format
+        self.sFileName = sFileName
+        self.format = format
+        self.batchSize = batchSize
+        self.queue = Queue.Queue(queueSize) # full queue blocks the capture thread
+        self.batch = []
+        self.nWorkers = nWorkers
+        self.pool = None
+        self.f = None
+        self.thread = None
+        self.error = None # set by the writer thread, raised on the capture thread
+        self.bErrorRaised = False
+
+    def OpenPipe(self):
+        self.f = open(self.sFileName, "w")
+        if self.nWorkers > 0:
+            import WS_SnifferWorkerPool
+            self.pool = WS_SnifferWorkerPool.cWS_SnifferWorkerPool([EXPORT_STAGES[self.format]], self.nWorkers,
+                                                                   chunkSize=self.batchSize)
+            target = self.PoolWriterThread
+        else:
+            target = self.WriterThread
+        self.thread = threading.Thread(target=target, name="export %s" % self.sFileName)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def ClosePipe(self):
+        if self.thread is None:
+            return
+        if self.pool is None:
+            # the writer thread keeps draining the queue after an error
+            if self.batch:
+                self.queue.put(self.batch)
+                self.batch = []
+            self.queue.put(None)
+        else:
+            self.pool.Close()
+        self.thread.join()
+        self.thread = None
+        if not self.pool is None:
+            if self.error is None:
+                self.pool.Join()
+            else:
+                self.pool.Terminate() # results may be left unread
+            self.pool = None
+        try:
+            self.f.close()
+        except IOError, err:
+            self.error = self.error or err
+        self.CheckError()
+
+    def CheckError(self):
+        """ raises the error of the writer thread as an IOError, once """
+        if not self.error is None and not self.bErrorRaised:
+            self.bErrorRaised = True
+            raise IOError("export to '%s' failed: %s" % (self.sFileName, self.error))
+
+    def getPipeName(self):
+        return self.sFileName
+
+    def WriteFileHeader(self):
+        # no records yet, so the writer thread is idle
+        if self.format == EXPORT_CSV:
+            self.f.write(",".join(EXPORT_FIELDS) + "\n")
+
+    def WriteRecord(self, snifferDataFrm, channel):
+        if not self.pool is None:
+            self.CheckError()
+            try:
+                self.pool.Put(snifferDataFrm, channel)
+            except RuntimeError, err:
+                self.error = self.error or err
+                self.CheckError()
+            return
+        self.batch.append((snifferDataFrm, channel))
+        if len(self.batch) >= self.batchSize:
+            self.Flush()
+
+    def Flush(self):
+        self.CheckError()
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def WriterThread(self):
+        stage = EXPORT_STAGES[self.format]
+        while 1:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            if not self.error is None:
+                continue # drain, so that the capture thread never blocks
+            try:
+                self.f.write(self.FormatBatch([stage(frm, ch) for frm, ch in batch]))
+                self.f.flush()
+            except Exception, err:
+                self.error = err
+
+    def PoolWriterThread(self):
+        items = []
+        while 1:
+            try:
+                result = self.pool.GetResult()
+            except RuntimeError, err:
+                self.error = self.error or err
+                if self.pool.isAlive():
+                    continue # a failed frame, the worker carries on
+                break
+            if not result is None:
+                items.append(result[0])
+            if items and (result is None or len(items) >= self.batchSize):
+                if self.error is None:
+                    try:
+                        self.f.write(self.FormatBatch(items))
+                        self.f.flush()
+                    except Exception, err:
+                        self.error = err
+                items = []
+            if result is None:
+                break
+
+    def FormatBatch(self, items):
+        """ joins the per record stage results of a batch """
+        if self.format == EXPORT_COLUMNS:
+            return json.dumps(dict(zip(EXPORT_FIELDS, [list(c) for c in zip(*items)]))) + "\n"
+        return "".join(items)
@@ -0,0 +1,51 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file maps the supported pcap encapsulations to the wrapper
+#    classes implementing them, for the modes selecting a wrapper by name.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import WS_SnifferLibPcapWrapper
+import WS_SnifferLibPcapZepWrapper
+
+ENCAP_802_15_4      = "802.15.4"
+ENCAP_ZEPV1         = "zepv1"
+ENCAP_NAMES         = [ENCAP_802_15_4, ENCAP_ZEPV1] # the first one is the default
+
+ENCAP = {ENCAP_802_15_4: WS_SnifferLibPcapWrapper.cWS_IEEE802_15_4_LibPcapWrapper,
+         ENCAP_ZEPV1:    WS_SnifferLibPcapZepWrapper.cWS_ZEPv1_LibPcapWrapper}
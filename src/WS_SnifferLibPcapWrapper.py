@@ -58,8 +58,11 @@ PCAP_VERSION_MINOR  = 4
 MICROS_PER_SYMBOL   = 16 # symbol duration in us
 
 class cWS_IEEE802_15_4_LibPcapWrapper:
-    def __init__(self):
+    def __init__(self, sPipeName=None, bFile=False):
+        """ with bFile set, sPipeName names a regular capture file to write """
         self.os = os.name
+        self.bFile = bFile
+        self.file = None
 
         if(self.os == 'nt'):
             self.sPipeName = r'\\.\pipe\wireshark'
@@ -67,11 +70,16 @@ class cWS_IEEE802_15_4_LibPcapWrapper:
             self.sPipeName = r'/tmp/wireshark'
             self.f = -1
 
+        if not sPipeName is None:
+            self.sPipeName = sPipeName
+
         self.p = None
         
     def OpenPipe(self):#,pipeName = r'\\.\pipe\wireshark'):
         #self.sPipeName = pipeName
-        if(self.os == 'nt'):
+        if(self.bFile):
+            self.file = open(self.sPipeName, "wb")
+        elif(self.os == 'nt'):
             self.p = win32pipe.CreateNamedPipe(
                 self.sPipeName,
                 win32pipe.PIPE_ACCESS_OUTBOUND,
@@ -86,6 +94,10 @@ class cWS_IEEE802_15_4_LibPcapWrapper:
             self.p = os.open(self.sPipeName, os.O_WRONLY)
         
     def ClosePipe(self):
+        if not self.file is None:
+            self.file.close()
+            self.file = None
+
         if not self.p is None:
             if(self.os == 'nt'):
                 win32pipe.DisconnectNamedPipe(self.p)
@@ -94,62 +106,60 @@ class cWS_IEEE802_15_4_LibPcapWrapper:
 
         if(self.os == 'posix' and self.f == 0):
             os.unlink(self.sPipeName)
+
+    def AbortOpenPipe(self):
+        """ releases an OpenPipe() blocked in another thread waiting for Wireshark,
+            by connecting to the pipe as a reader that goes away at once
+        """
+        if(self.bFile):
+            return
+        try:
+            if(self.os == 'nt'):
+                h = win32file.CreateFile(self.sPipeName, win32file.GENERIC_READ, 0, None,
+                                         win32file.OPEN_EXISTING, 0, None)
+                win32file.CloseHandle(h)
+            elif(self.os == 'posix'):
+                fd = os.open(self.sPipeName, os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+        except Exception:
+            pass # not created yet, or already connected
         
     def getPipeName(self):
         return self.sPipeName
         
-    def WriteFileHeader(self):
-        if(self.os == 'nt'):
-            win32file.WriteFile(self.p, struct.pack("<L",TCPDUMP_MAGIC))
-            win32file.WriteFile(self.p, struct.pack("<H",PCAP_VERSION_MAJOR))
-            win32file.WriteFile(self.p, struct.pack("<H",PCAP_VERSION_MINOR))
-    
-            win32file.WriteFile(self.p, struct.pack("<L",0)) # u32Thiszone: gmt to local correction
-            win32file.WriteFile(self.p, struct.pack("<L",0)) # u32Sigfigs: accuracy of time stamps
-            win32file.WriteFile(self.p, struct.pack("<L",200)) # u32Snaplen: max length saved portion of each pkt
-            win32file.WriteFile(self.p, struct.pack("<L",DLT_IEEE802_15_4)) # u32LinkType: data link type (LINKTYPE_*) 
-
+    def WritePipe(self, s):
+        if not self.file is None:
+            self.file.write(s)
+        elif(self.os == 'nt'):
+            win32file.WriteFile(self.p, s)
         elif(self.os == 'posix'):
-            os.write(self.p, struct.pack("<L",TCPDUMP_MAGIC))
-            os.write(self.p, struct.pack("<H",PCAP_VERSION_MAJOR))
-            os.write(self.p, struct.pack("<H",PCAP_VERSION_MINOR))
-            
-            os.write(self.p, struct.pack("<L",0)) # u32Thiszone: gmt to local correction
-            os.write(self.p, struct.pack("<L",0)) # u32Sigfigs: accuracy of time stamps
-            os.write(self.p, struct.pack("<L",200)) # u32Snaplen: max length saved portion of each pkt
-            os.write(self.p, struct.pack("<L",DLT_IEEE802_15_4)) # u32LinkType: data link type (LINKTYPE_*) 
-    
-    def WriteRecord(self, snifferDataFrm, channel):
+            os.write(self.p, s)
+        
+    def EncodeFileHeader(self):
+        return (struct.pack("<L",TCPDUMP_MAGIC)
+                + struct.pack("<H",PCAP_VERSION_MAJOR)
+                + struct.pack("<H",PCAP_VERSION_MINOR)
+                + struct.pack("<L",0) # u32Thiszone: gmt to local correction
+                + struct.pack("<L",0) # u32Sigfigs: accuracy of time stamps
+                + struct.pack("<L",200) # u32Snaplen: max length saved portion of each pkt
+                + struct.pack("<L",DLT_IEEE802_15_4)) # u32LinkType: data link type (LINKTYPE_*) 
+
+    def EncodeRecord(self, snifferDataFrm, channel):
         pktLen = snifferDataFrm.getMsduLen()
         timeStamp = MICROS_PER_SYMBOL * snifferDataFrm.getTimeStamp()
     
         i32Secs = timeStamp // 1000000
         i32MicroSecs = timeStamp % 1000000
 
-        if(self.os == 'nt'): 
-            win32file.WriteFile(self.p, struct.pack("<l",i32Secs)) # seconds
-            win32file.WriteFile(self.p, struct.pack("<l",i32MicroSecs)) # microseconds
-        
-            # length of portion present
-            win32file.WriteFile(self.p, struct.pack("<L",pktLen)) # u32
-        
-            # length this packet (off wire)
-            win32file.WriteFile(self.p, struct.pack("<L",pktLen+2)) # u32
-    
-            # Record data
-            win32file.WriteFile(self.p, snifferDataFrm.getMsdu())
-            #print binascii.hexlify(snifferDataFrm.getMsdu())
+        return (struct.pack("<l",i32Secs) # seconds
+                + struct.pack("<l",i32MicroSecs) # microseconds
+                + struct.pack("<L",pktLen) # u32 length of portion present
+                + struct.pack("<L",pktLen+2) # u32 length this packet (off wire)
+                + snifferDataFrm.getMsdu()) # Record data
 
-        elif(self.os == 'posix'):
-            os.write(self.p, struct.pack("<l",i32Secs)) # seconds
-            os.write(self.p, struct.pack("<l",i32MicroSecs)) # microseconds
-        
-            # length of portion present
-            os.write(self.p, struct.pack("<L",pktLen)) # u32
-        
-            # length this packet (off wire)
-            os.write(self.p, struct.pack("<L",pktLen+2)) # u32
+    def WriteFileHeader(self):
+        self.WritePipe(self.EncodeFileHeader())
     
-            # Record data
-            os.write(self.p, snifferDataFrm.getMsdu())
-            #print binascii.hexlify(snifferDataFrm.getMsdu())
+    def WriteRecord(self, snifferDataFrm, channel):
+        self.WritePipe(self.EncodeRecord(snifferDataFrm, channel))
+        #print binascii.hexlify(snifferDataFrm.getMsdu())
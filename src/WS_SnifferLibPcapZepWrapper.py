@@ -156,8 +156,11 @@ class cWS_ZEPv1_LibPcapWrapper:
                       "\x00\x00\x00\x00\x00\x00\x00", # Reserved
                       pduLen)
 
-    def __init__(self):
+    def __init__(self, sPipeName=None, bFile=False):
+        """ with bFile set, sPipeName names a regular capture file to write """
         self.os = os.name
+        self.bFile = bFile
+        self.file = None
 
         if(self.os == 'nt'):
             self.sPipeName = r'\\.\pipe\wireshark'
@@ -165,11 +168,16 @@ class cWS_ZEPv1_LibPcapWrapper:
             self.sPipeName = r'/tmp/wireshark'
             self.f = -1
 
+        if not sPipeName is None:
+            self.sPipeName = sPipeName
+
         self.p = None
         
     def OpenPipe(self):#,pipeName = r'\\.\pipe\wireshark'):
         #self.sPipeName = pipeName
-        if(self.os == 'nt'):
+        if(self.bFile):
+            self.file = open(self.sPipeName, "wb")
+        elif(self.os == 'nt'):
             self.p = win32pipe.CreateNamedPipe(
                 self.sPipeName,
                 win32pipe.PIPE_ACCESS_OUTBOUND,
@@ -184,6 +192,10 @@ class cWS_ZEPv1_LibPcapWrapper:
             self.p = os.open(self.sPipeName, os.O_WRONLY)
         
     def ClosePipe(self):
+        if not self.file is None:
+            self.file.close()
+            self.file = None
+
         if not self.p is None:
             if(self.os == 'nt'):
                 win32pipe.DisconnectNamedPipe(self.p)
@@ -192,46 +204,89 @@ class cWS_ZEPv1_LibPcapWrapper:
 
         if(self.os == 'posix' and self.f == 0):
             os.unlink(self.sPipeName)
+
+    def AbortOpenPipe(self):
+        """ releases an OpenPipe() blocked in another thread waiting for Wireshark,
+            by connecting to the pipe as a reader that goes away at once
+        """
+        if(self.bFile):
+            return
+        try:
+            if(self.os == 'nt'):
+                h = win32file.CreateFile(self.sPipeName, win32file.GENERIC_READ, 0, None,
+                                         win32file.OPEN_EXISTING, 0, None)
+                win32file.CloseHandle(h)
+            elif(self.os == 'posix'):
+                fd = os.open(self.sPipeName, os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+        except Exception:
+            pass # not created yet, or already connected
         
     def getPipeName(self):
         return self.sPipeName
 
     def WritePipe(self, s):
-        if(self.os == 'nt'):
+        if not self.file is None:
+            self.file.write(s)
+        elif(self.os == 'nt'):
             win32file.WriteFile(self.p, s)
         elif(self.os == 'posix'):
             os.write(self.p, s)
         
-    def WriteFileHeader(self):
-        self.WritePipe(cWS_ZEPv1_LibPcapWrapper.pcapGlobalHdr)
+    def EncodeFileHeader(self):
+        return cWS_ZEPv1_LibPcapWrapper.pcapGlobalHdr
 
-    def WriteRecord(self, snifferDataFrm, channel):
+    def EncodeRecord(self, snifferDataFrm, channel):
         timestamp = snifferDataFrm.getTimeStamp()
         pktLen = snifferDataFrm.getMsduLen()
         pktLen += 2 # ZEP requires a full PDU with the two FCS octets
-        lqi = snifferDataFrm.getLinkQuality()
-        rssi = (lqi // 3) - 100 # dBm
         # limit the length of capture to the actual PSDU length
         pcapInclLen = IPV4_LEN_MAX - PKT_LEN_MAX + pktLen
 
-        # PCAP packet header
-        pcapPktHdr = cWS_ZEPv1_LibPcapWrapper.GetPcapPktHdr(timestamp,
-                                                            pcapInclLen)
-        self.WritePipe(pcapPktHdr)
-    
-        # IPv4 header
-        self.WritePipe(cWS_ZEPv1_LibPcapWrapper.ipv4Hdr)
-
-        # UDP header
-        self.WritePipe(cWS_ZEPv1_LibPcapWrapper.udpHdr)
+        return (cWS_ZEPv1_LibPcapWrapper.GetPcapPktHdr(timestamp, pcapInclLen) # PCAP packet header
+                + cWS_ZEPv1_LibPcapWrapper.ipv4Hdr # IPv4 header
+                + cWS_ZEPv1_LibPcapWrapper.udpHdr # UDP header
+                + cWS_ZEPv1_LibPcapWrapper.GetZepPdu(snifferDataFrm, channel)) # ZEP header + record data
 
-        # ZEP header
-        self.WritePipe(cWS_ZEPv1_LibPcapWrapper.GetZepHdr(channel, pktLen, lqi))
+    @staticmethod
+    def GetZepPdu(snifferDataFrm, channel):
+        pktLen = snifferDataFrm.getMsduLen() + 2 # ZEP requires a full PDU with the two FCS octets
+        lqi = snifferDataFrm.getLinkQuality()
+        rssi = (lqi // 3) - 100 # dBm
+        return (cWS_ZEPv1_LibPcapWrapper.GetZepHdr(channel, pktLen, lqi)
+                + snifferDataFrm.getMsdu()
+                + struct.pack("!b B",
+                              rssi, # RSSI in dBm (Chipcon format)
+                              0x80 | 0x00)) # FCS valid bit + correlation (Chipcon format)
 
-        # Record data
-        self.WritePipe(snifferDataFrm.getMsdu())
-        self.WritePipe(struct.pack("!b B",
-                                   rssi, # RSSI in dBm (Chipcon format)
-                                   0x80 | 0x00)) # FCS valid bit + correlation (Chipcon format)
+    def WriteFileHeader(self):
+        self.WritePipe(self.EncodeFileHeader())
 
+    def WriteRecord(self, snifferDataFrm, channel):
+        self.WritePipe(self.EncodeRecord(snifferDataFrm, channel))
         #print binascii.hexlify(snifferDataFrm.getMsdu())
+
+class cWS_ZEPv1_UdpWrapper:
+    """ Sends ZEPv1 packets as UDP datagrams, e.g. to a Wireshark listening
+        on UDP port 17754, with the same interface as the pipe wrappers.
+    """
+    def __init__(self, sHost="127.0.0.1", port=ZEP_DEFAULT_PORT):
+        self.addr = (sHost, port)
+        self.sock = None
+
+    def OpenPipe(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def ClosePipe(self):
+        if not self.sock is None:
+            self.sock.close()
+            self.sock = None
+
+    def getPipeName(self):
+        return "udp:%s:%d" % self.addr
+
+    def WriteFileHeader(self):
+        pass
+
+    def WriteRecord(self, snifferDataFrm, channel):
+        self.sock.sendto(cWS_ZEPv1_LibPcapWrapper.GetZepPdu(snifferDataFrm, channel), self.addr)
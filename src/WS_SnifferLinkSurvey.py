@@ -0,0 +1,181 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements aggregation of the link quality reported by the
+#    sniffer device for site surveys (e.g. combined with --scan).
+#
+#    LQI histograms are kept per channel and per source (PAN ID and
+#    address, see GetSourceId) in a preallocated NumPy array. Frames are
+#    only appended to a small batch buffer on receipt; the histogram is
+#    updated once per batch, keeping the per frame cost low. Percentiles of LQI and the derived RSSI are
+#    exported as CSV/JSON heatmaps (channel x source).
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import json
+import numpy
+from WS_SnifferMacHeader import ParseMacHeader, GetSourceId
+
+CHANNEL_FIRST       = 11
+CHANNEL_LAST        = 26
+NUM_CHANNELS        = CHANNEL_LAST - CHANNEL_FIRST + 1
+NUM_LQI             = 256
+
+SOURCE_OTHER        = "other" # no source address, or source table full
+PERCENTILES         = (10, 50, 90)
+
+def LqiToRssi(lqi):
+    """ Rough RSSI in dBm, as used for the ZEP encapsulation """
+    return (lqi // 3) - 100
+
+class cWS_SnifferLinkSurvey:
+    """ Per channel, per source LQI histograms """
+#==============================================================================
+    def __init__(self, maxSources=256, batchSize=1024):
+        self.maxSources = maxSources
+        self.sources = [SOURCE_OTHER]
+        self.sourceIdx = {None: 0}
+
+        self.hist = numpy.zeros((NUM_CHANNELS, maxSources + 1, NUM_LQI), dtype=numpy.uint32)
+        self.histFlat = self.hist.reshape(-1) # view used for the batch updates
+        self.batch = numpy.zeros(batchSize, dtype=numpy.intp)
+        self.nBatch = 0
+
+    def AddFrame(self, dataFrm, channel):
+        self.AddSample(channel, GetSourceId(ParseMacHeader(dataFrm.getMsdu())), dataFrm.getLinkQuality())
+
+    def AddSample(self, channel, src, lqi):
+        """ adds the link quality of one frame from source src (see GetSourceId) """
+        if channel < CHANNEL_FIRST or channel > CHANNEL_LAST:
+            return
+
+        idx = self.sourceIdx.get(src)
+        if idx is None:
+            idx = self.AddSource(src)
+
+        self.batch[self.nBatch] = (((channel - CHANNEL_FIRST) * (self.maxSources + 1) + idx) * NUM_LQI + lqi)
+        self.nBatch += 1
+        if self.nBatch == len(self.batch):
+            self.Flush()
+
+    def AddSource(self, src):
+        if len(self.sources) > self.maxSources:
+            idx = 0
+        else:
+            idx = len(self.sources)
+            self.sources.append(src)
+        self.sourceIdx[src] = idx
+        return idx
+
+    def Flush(self):
+        if self.nBatch > 0:
+            numpy.add.at(self.histFlat, self.batch[:self.nBatch], 1)
+            self.nBatch = 0
+
+    def getHistogram(self):
+        """ returns the LQI histogram array indexed [channel - 11, source index, lqi] """
+        self.Flush()
+        return self.hist[:, :len(self.sources), :]
+
+    def getSources(self):
+        return list(self.sources)
+
+    def getStats(self):
+        """ returns (frames, lqiMean, lqiPercentiles), each indexed [channel - 11, source index].
+            lqiPercentiles has an additional last axis following PERCENTILES.
+        """
+        hist = self.getHistogram()
+        frames = hist.sum(axis=2, dtype=numpy.uint64)
+        lqiSum = (hist * numpy.arange(NUM_LQI, dtype=numpy.uint64)).sum(axis=2)
+        lqiMean = lqiSum / numpy.maximum(frames, 1).astype(numpy.float64)
+
+        cum = hist.cumsum(axis=2, dtype=numpy.uint64)
+        lqiPercentiles = numpy.zeros(frames.shape + (len(PERCENTILES),), dtype=numpy.int32)
+        for i, q in enumerate(PERCENTILES):
+            target = numpy.maximum(numpy.ceil(frames * (q / 100.0)), 1)
+            lqiPercentiles[:, :, i] = (cum < target[:, :, numpy.newaxis]).sum(axis=2)
+        return frames, lqiMean, lqiPercentiles
+
+    def getRows(self):
+        """ returns one dict per channel and source with frames received """
+        frames, lqiMean, lqiPercentiles = self.getStats()
+        rows = []
+        for c, s in zip(*numpy.nonzero(frames)):
+            row = {"channel": int(c) + CHANNEL_FIRST,
+                   "source": self.sources[s],
+                   "frames": int(frames[c, s]),
+                   "lqi_mean": round(float(lqiMean[c, s]), 1)}
+            for i, q in enumerate(PERCENTILES):
+                row["lqi_p%d" % q] = int(lqiPercentiles[c, s, i])
+                row["rssi_p%d" % q] = LqiToRssi(int(lqiPercentiles[c, s, i]))
+            rows.append(row)
+        return rows
+
+    def getColumns(self):
+        columns = ["channel", "source", "frames", "lqi_mean"]
+        columns += ["lqi_p%d" % q for q in PERCENTILES]
+        columns += ["rssi_p%d" % q for q in PERCENTILES]
+        return columns
+
+    def ExportCsv(self, sFileName):
+        columns = self.getColumns()
+        f = open(sFileName, "w")
+        try:
+            f.write(",".join(columns) + "\n")
+            for row in self.getRows():
+                f.write(",".join([str(row[col]) for col in columns]) + "\n")
+        finally:
+            f.close()
+
+    def ExportJson(self, sFileName):
+        hist = self.getHistogram()
+        rows = self.getRows()
+        for row in rows:
+            lqiHist = hist[row["channel"] - CHANNEL_FIRST, self.sources.index(row["source"])]
+            row["lqi_histogram"] = dict((int(lqi), int(lqiHist[lqi])) for lqi in numpy.nonzero(lqiHist)[0])
+        f = open(sFileName, "w")
+        try:
+            json.dump({"channels": range(CHANNEL_FIRST, CHANNEL_LAST + 1),
+                       "sources": self.sources,
+                       "rows": rows}, f, indent=1)
+        finally:
+            f.close()
+
+    def Export(self, sBaseName):
+        """ writes <sBaseName>.csv and <sBaseName>.json """
+        self.ExportCsv(sBaseName + ".csv")
+        self.ExportJson(sBaseName + ".json")
@@ -0,0 +1,222 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements estimation of the frames missed by the capture.
+#
+#    The 802.15.4 MAC sequence number (DSN/BSN, modulo 256) is tracked
+#    per channel and source (PAN ID and address, see GetSourceId), with
+#    beacons (BSN) apart from other frames (DSN). A repeated sequence
+#    number counts as a retry, a gap as missed frames. Gaps larger than
+#    MAX_SEQ_GAP are taken as a node restart and not counted. Frames
+#    without a source address (e.g. acknowledgements) are not attributed.
+#
+#    In addition the sniffer time stamps are compared with the host
+#    arrival times; a time stamp going backwards, or both clocks
+#    disagreeing by more than TS_TOLERANCE, is counted as a time stamp
+#    discontinuity (device reset or serial overflow). This check is off
+#    for replays, whose arrival times do not follow the capture.
+#
+#    Counters are written per interval to a CSV file, one row per channel
+#    and source plus a "*" row per channel with the totals.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import time
+from WS_SnifferMacHeader import ParseMacHeader, GetSourceId, MAC_FRAME_BEACON
+
+SEQ_MODULO          = 256
+MAX_SEQ_GAP         = 64  # larger jumps are taken as a restart, not as loss
+TS_TOLERANCE        = 0.5 # s
+TS_WRAP             = 1 << 32 # sniffer time stamps are u32 symbol counts
+MICROS_PER_SYMBOL   = 16 # symbol duration in us
+
+LOSS_COLUMNS = ["time", "channel", "source", "received", "missed", "retries", "loss_pct", "ts_discontinuities"]
+
+def NewCounters():
+    """ returns [received, missed, retries] """
+    return [0, 0, 0]
+
+class cWS_SnifferLossEstimator:
+    def __init__(self, sFileName=None, fInterval=10.0, bCheckTimeStamps=True):
+        self.sFileName = sFileName
+        self.fInterval = fInterval
+        self.bCheckTimeStamps = bCheckTimeStamps
+        self.fIntervalEnd = None
+
+        self.lastSeq = {}      # (channel, source, beacon): sequence number
+        self.pendingSeq = {}   # sequence numbers after a jump, awaiting confirmation
+        self.lastTs = None
+        self.lastArrival = None
+
+        self.totals = {}       # (channel, source): counters
+        self.interval = {}
+        self.discontinuities = {} # channel: count
+        self.intervalDiscontinuities = {}
+
+        if not self.sFileName is None:
+            f = open(self.sFileName, "w")
+            try:
+                f.write(",".join(LOSS_COLUMNS) + "\n")
+            finally:
+                f.close()
+
+    def ChangeChannel(self):
+        """ to be called on channel changes; frames sent while listening
+            elsewhere are not capture loss
+        """
+        self.lastSeq = {}
+        self.pendingSeq = {}
+        self.lastTs = None
+        self.lastArrival = None
+
+    def AddFrame(self, dataFrm, channel, arrivalTime=None):
+        if arrivalTime is None:
+            arrivalTime = time.time()
+        hdr = ParseMacHeader(dataFrm.getMsdu())
+        if hdr is None:
+            self.AddSequenceNumber(None, None, False, dataFrm.getTimeStamp(), channel, arrivalTime)
+        else:
+            self.AddSequenceNumber(GetSourceId(hdr), hdr[1], hdr[0] == MAC_FRAME_BEACON,
+                                   dataFrm.getTimeStamp(), channel, arrivalTime)
+
+    def AddSequenceNumber(self, source, seq, isBeacon, ts, channel, arrivalTime):
+        """ adds a frame by its source (see GetSourceId), MAC sequence number
+            and sniffer time stamp, e.g. as decoded by a worker process
+        """
+        if self.fIntervalEnd is None:
+            self.fIntervalEnd = arrivalTime + self.fInterval
+        elif arrivalTime >= self.fIntervalEnd:
+            self.WriteInterval(arrivalTime)
+
+        if self.bCheckTimeStamps:
+            self.CheckTimeStamp(ts, channel, arrivalTime)
+
+        if source is None:
+            return
+        key = (channel, source)
+        # beacons carry the BSN, all other frames the DSN of the same source
+        seqKey = key + (isBeacon,)
+
+        counters = self.interval.get(key)
+        if counters is None:
+            counters = self.interval[key] = NewCounters()
+        counters[0] += 1
+
+        last = self.lastSeq.get(seqKey)
+        if last is None:
+            self.lastSeq[seqKey] = seq
+            return
+        gap = (seq - last) % SEQ_MODULO
+        if gap == 0:
+            counters[2] += 1
+        elif gap <= MAX_SEQ_GAP:
+            counters[1] += gap - 1
+            self.lastSeq[seqKey] = seq
+            self.pendingSeq.pop(seqKey, None)
+        else:
+            # a reordered frame or a restart; keep the previous sequence number
+            # unless the frame follows one that jumped the same way
+            pending = self.pendingSeq.get(seqKey)
+            if not pending is None and (seq - pending) % SEQ_MODULO == 1:
+                self.lastSeq[seqKey] = seq
+                del self.pendingSeq[seqKey]
+            else:
+                self.pendingSeq[seqKey] = seq
+
+    def CheckTimeStamp(self, ts, channel, arrivalTime):
+        lastTs = self.lastTs
+        lastArrival = self.lastArrival
+        self.lastTs = ts
+        self.lastArrival = arrivalTime
+        if lastTs is None:
+            return
+
+        tsDelta = ((ts - lastTs) % TS_WRAP) * MICROS_PER_SYMBOL / 1000000.0
+        backwards = ts < lastTs and lastTs - ts < TS_WRAP // 2
+        if backwards or abs(tsDelta - (arrivalTime - lastArrival)) > TS_TOLERANCE:
+            self.intervalDiscontinuities[channel] = self.intervalDiscontinuities.get(channel, 0) + 1
+
+    def getRows(self, counters, discontinuities, now):
+        rows = []
+        channelTotals = {}
+        for (channel, source), c in sorted(counters.items()):
+            rows.append([now, channel, source] + c + [""])
+            total = channelTotals.setdefault(channel, NewCounters())
+            for i in range(len(c)):
+                total[i] += c[i]
+        for channel in sorted(set(channelTotals.keys() + discontinuities.keys())):
+            rows.append([now, channel, "*"] + channelTotals.get(channel, NewCounters()) + [discontinuities.get(channel, 0)])
+        for row in rows:
+            received, missed = row[3], row[4]
+            row.insert(6, round(100.0 * missed / max(received + missed, 1), 2))
+        return rows
+
+    def WriteInterval(self, now=None):
+        """ adds the interval counters to the totals and writes them out """
+        if now is None:
+            now = time.time()
+        if not self.sFileName is None:
+            f = open(self.sFileName, "a")
+            try:
+                for row in self.getRows(self.interval, self.intervalDiscontinuities, "%.3f" % now):
+                    f.write(",".join([str(v) for v in row]) + "\n")
+            finally:
+                f.close()
+
+        for key, c in self.interval.items():
+            total = self.totals.setdefault(key, NewCounters())
+            for i in range(len(c)):
+                total[i] += c[i]
+        for channel, n in self.intervalDiscontinuities.items():
+            self.discontinuities[channel] = self.discontinuities.get(channel, 0) + n
+        self.interval = {}
+        self.intervalDiscontinuities = {}
+        self.fIntervalEnd = now + self.fInterval
+
+    def Close(self):
+        self.WriteInterval()
+
+    def getReport(self):
+        """ returns a per channel summary of the totals """
+        lines = []
+        for row in self.getRows(self.totals, self.discontinuities, ""):
+            if row[2] == "*":
+                line = "Channel %d: %d received, ~%d missed (%.2f%%), %d retries" % (row[1], row[3], row[4], row[6], row[5])
+                if self.bCheckTimeStamps:
+                    line += ", %d time stamp discontinuities" % row[7]
+                lines.append(line)
+        return "\n".join(lines)
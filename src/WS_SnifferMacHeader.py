@@ -0,0 +1,132 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements minimal decoding of the IEEE802.15.4 MAC header
+#    of the MSDU's received from the sniffer device (frame type, sequence
+#    number, PAN ID's and addresses), as needed for per-node statistics.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import struct
+
+MAC_FRAME_BEACON    = 0
+MAC_FRAME_DATA      = 1
+MAC_FRAME_ACK       = 2
+MAC_FRAME_CMD       = 3
+
+MAC_ADDR_NONE       = 0
+MAC_ADDR_RESERVED   = 1
+MAC_ADDR_SHORT      = 2
+MAC_ADDR_LONG       = 3
+
+MAC_FC_PAN_ID_COMPRESSION = 0x0040
+
+structFcSeq = struct.Struct("<HB")
+structU16 = struct.Struct("<H")
+structU64 = struct.Struct("<Q")
+
+def ParseMacHeader(msdu):
+    """ returns (frameType, seqNo, dstPanId, dstAddr, srcPanId, srcAddr)
+
+        PAN ID's are integers and addresses hex strings (4 digits for short,
+        16 digits for extended addresses). Absent fields are None. Returns
+        None if the MSDU is too short to hold the header it announces, or
+        uses the reserved addressing mode.
+    """
+    if len(msdu) < 3:
+        return None
+    fc, seqNo = structFcSeq.unpack_from(msdu, 0)
+    frameType = fc & 0x07
+    dstMode = (fc >> 10) & 0x03
+    srcMode = (fc >> 14) & 0x03
+    if dstMode == MAC_ADDR_RESERVED or srcMode == MAC_ADDR_RESERVED:
+        return None
+
+    offset = 3
+    dstPanId = dstAddr = srcPanId = srcAddr = None
+    try:
+        if dstMode != MAC_ADDR_NONE:
+            dstPanId = structU16.unpack_from(msdu, offset)[0]
+            offset += 2
+            if dstMode == MAC_ADDR_SHORT:
+                dstAddr = "%04x" % structU16.unpack_from(msdu, offset)[0]
+                offset += 2
+            else:
+                dstAddr = "%016x" % structU64.unpack_from(msdu, offset)[0]
+                offset += 8
+        if srcMode != MAC_ADDR_NONE:
+            if (fc & MAC_FC_PAN_ID_COMPRESSION) and dstMode != MAC_ADDR_NONE:
+                srcPanId = dstPanId
+            else:
+                srcPanId = structU16.unpack_from(msdu, offset)[0]
+                offset += 2
+            if srcMode == MAC_ADDR_SHORT:
+                srcAddr = "%04x" % structU16.unpack_from(msdu, offset)[0]
+            else:
+                srcAddr = "%016x" % structU64.unpack_from(msdu, offset)[0]
+    except struct.error:
+        return None
+
+    return (frameType, seqNo, dstPanId, dstAddr, srcPanId, srcAddr)
+
+def GetSourceId(hdr):
+    """ returns "<source PAN ID>:<source address>" of a parsed MAC header, or
+        None. The PAN ID tells apart nodes of co-channel networks sharing a
+        short address, e.g. their coordinators (0000)
+    """
+    if hdr is None or hdr[5] is None:
+        return None
+    return "%04x:%s" % (hdr[4], hdr[5])
+
+MAC_ADDR_LEN = {MAC_ADDR_NONE: 0, MAC_ADDR_SHORT: 2, MAC_ADDR_LONG: 8}
+
+def GetMacHeaderLen(msdu):
+    """ returns the length of the MAC header, i.e. the offset of the MAC
+        payload, or None for the reserved addressing mode (as ParseMacHeader)
+    """
+    fc = structU16.unpack_from(msdu, 0)[0]
+    dstMode = (fc >> 10) & 0x03
+    srcMode = (fc >> 14) & 0x03
+    if dstMode == MAC_ADDR_RESERVED or srcMode == MAC_ADDR_RESERVED:
+        return None
+
+    hdrLen = 3 + MAC_ADDR_LEN[dstMode] + MAC_ADDR_LEN[srcMode]
+    if dstMode != MAC_ADDR_NONE:
+        hdrLen += 2
+    if srcMode != MAC_ADDR_NONE and not ((fc & MAC_FC_PAN_ID_COMPRESSION) and dstMode != MAC_ADDR_NONE):
+        hdrLen += 2
+    return hdrLen
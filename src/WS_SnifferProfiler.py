@@ -0,0 +1,292 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements a profiling mode for capture sessions, to find
+#    where the time goes when frames are dropped.
+#
+#    The cWS_SnifferProfiler wraps the adapter and pipe wrapper methods
+#    of a running session and accumulates wall time per stage (adapter
+#    receive, encapsulation, sink write, scan switching). In addition
+#    cProfile runs over a bounded window at the start of the session, its
+#    results grouped by stage, and the allocations of that window are
+#    measured: with tracemalloc where available (Python 3.4+), else as the
+#    growth of the objects tracked by the garbage collector, per class,
+#    and the peak resident set size.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import sys, time, gc, cProfile, pstats
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None # not available before Python 3.4
+try:
+    import resource
+except ImportError:
+    resource = None # posix only
+
+STAGE_RECEIVE       = "adapter receive"
+STAGE_ENCAP         = "encapsulation"
+STAGE_SINK          = "sink write"
+STAGE_SCAN          = "scan switching"
+STAGE_OTHER         = "other"
+STAGES = [STAGE_RECEIVE, STAGE_ENCAP, STAGE_SINK, STAGE_SCAN]
+
+# Function names used to attribute cProfile entries to stages, checked in
+# order. Builtins only show up by name, so this is approximate.
+STAGE_FUNCTIONS = [
+    (STAGE_SCAN,    ["ChangeLogicalChannel", "Reset", "SetSnifferMode", "SetRxOnWhenidle",
+                     "SetLogicalChannel", "SetMacPromiscuousMode", "SendFrm", "flushInput"]),
+    (STAGE_RECEIVE, ["RcvDataFrame", "RcvFrame", "rcvStx", "read", "select", "getFCS"]),
+    (STAGE_SINK,    ["WriteRecord", "WritePipe", "WriteFile", "write", "Flush", "put", "Put", "Add"]),
+    (STAGE_ENCAP,   ["EncodeRecord", "GetPcapPktHdr", "GetZepHdr", "GetZepPdu", "pack", "getMsdu",
+                     "getTimeStamp", "getLinkQuality"]),
+]
+
+# File name fragments used to attribute tracemalloc statistics to stages
+STAGE_FILES = [
+    (STAGE_RECEIVE, ["WS_SnifferAdapterFreescale", "serial"]),
+    (STAGE_ENCAP,   ["WS_SnifferLibPcap"]),
+]
+
+def GetFunctionName(funcName):
+    """ returns the bare name of a cProfile function entry, e.g. write for
+        "<method 'write' of 'file' objects>" and select for "<select.select>"
+    """
+    if funcName.startswith("<method '"):
+        return funcName.split("'")[1]
+    if funcName.startswith("<") and funcName.endswith(">"):
+        return funcName[1:-1].split(".")[-1]
+    return funcName
+
+def GetFunctionStage(funcName):
+    name = GetFunctionName(funcName)
+    for stage, names in STAGE_FUNCTIONS:
+        if name in names:
+            return stage
+    return STAGE_OTHER
+
+def CountObjects():
+    """ returns {class name: count} of the objects tracked by the garbage collector """
+    counts = {}
+    for obj in gc.get_objects():
+        try:
+            name = obj.__class__.__name__ # old style instances are all of type instance
+        except Exception:
+            name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+def GetPeakRss():
+    """ returns the peak resident set size in kB, or None """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024 # bytes
+    return peak
+
+def GetFileStage(fileName):
+    for stage, fragments in STAGE_FILES:
+        for fragment in fragments:
+            if fragment in fileName:
+                return stage
+    return STAGE_OTHER
+
+class cWS_SnifferProfiler:
+    """ Stage timing for a capture session, plus cProfile and allocations
+        over the first fWindow seconds.
+    """
+#==============================================================================
+    def __init__(self, fWindow=30.0):
+        self.fWindow = fWindow
+        self.times = dict((stage, 0.0) for stage in STAGES)
+        self.calls = dict((stage, 0) for stage in STAGES)
+        self.fStart = None
+        self.fStop = None
+
+        self.profile = cProfile.Profile()
+        self.fWindowEnd = None
+        self.snapshot = None
+        self.objectCounts = None
+        self.objectGrowth = None
+        self.peakRss = None
+
+    def Timed(self, stage, func):
+        """ returns func wrapped to accumulate its wall time in stage """
+        times = self.times
+        calls = self.calls
+        def timed(*args):
+            before = time.time()
+            try:
+                return func(*args)
+            finally:
+                times[stage] += time.time() - before
+                calls[stage] += 1
+        return timed
+
+    def Instrument(self, snifferAdapter, pipeWrapper):
+        """ wraps the stage methods of the given objects; snifferAdapter may be None (replay) """
+        if not snifferAdapter is None:
+            rcvDataFrame = self.Timed(STAGE_RECEIVE, snifferAdapter.RcvDataFrame)
+            def checkedRcv():
+                self.CheckWindow()
+                return rcvDataFrame()
+            snifferAdapter.RcvDataFrame = checkedRcv
+            snifferAdapter.ChangeLogicalChannel = self.Timed(STAGE_SCAN, snifferAdapter.ChangeLogicalChannel)
+
+        # pcap wrappers encode a record and then write it. The ring and the
+        # export sinks only hand the raw frame on (ring buffer, writer thread
+        # or worker pool) and encode elsewhere, so their WriteRecord is sink time
+        if hasattr(pipeWrapper, "EncodeRecord"):
+            recordName = "EncodeRecord"
+            pipeWrapper.WritePipe = self.Timed(STAGE_SINK, pipeWrapper.WritePipe)
+            record = self.Timed(STAGE_ENCAP, pipeWrapper.EncodeRecord)
+        else:
+            recordName = "WriteRecord"
+            record = self.Timed(STAGE_SINK, pipeWrapper.WriteRecord)
+        if snifferAdapter is None:
+            def checkedRecord(snifferDataFrm, channel):
+                self.CheckWindow()
+                return record(snifferDataFrm, channel)
+            setattr(pipeWrapper, recordName, checkedRecord)
+        else:
+            setattr(pipeWrapper, recordName, record)
+
+    def Start(self):
+        self.fStart = time.time()
+        self.fWindowEnd = self.fStart + self.fWindow
+        if not tracemalloc is None:
+            tracemalloc.start()
+        else:
+            self.objectCounts = CountObjects()
+        self.profile.enable()
+
+    def CheckWindow(self):
+        if not self.fWindowEnd is None and time.time() >= self.fWindowEnd:
+            self.StopWindow()
+
+    def StopWindow(self):
+        if self.fWindowEnd is None:
+            return
+        self.profile.disable()
+        if not tracemalloc is None:
+            self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        else:
+            counts = CountObjects()
+            self.objectGrowth = dict((name, n - self.objectCounts.get(name, 0)) for name, n in counts.items())
+        self.peakRss = GetPeakRss()
+        self.fWindowEnd = None
+
+    def Stop(self):
+        self.StopWindow()
+        self.fStop = time.time()
+
+    def getStageTimes(self):
+        """ returns {stage: (calls, seconds)} """
+        return dict((stage, (self.calls[stage], self.times[stage])) for stage in STAGES)
+
+    def getProfileByStage(self):
+        """ returns {stage: [(tottime, ncalls, function), ...]} from the cProfile window """
+        byStage = {}
+        stats = pstats.Stats(self.profile).stats
+        for (fileName, line, funcName), (cc, nc, tt, ct, callers) in stats.items():
+            stage = GetFunctionStage(funcName)
+            function = "%s:%d(%s)" % (fileName, line, funcName)
+            byStage.setdefault(stage, []).append((tt, nc, function))
+        for entries in byStage.values():
+            entries.sort(reverse=True)
+        return byStage
+
+    def getAllocationsByStage(self):
+        """ returns {stage: (blocks, bytes)} from the tracemalloc snapshot, or None """
+        if self.snapshot is None:
+            return None
+        byStage = {}
+        for stat in self.snapshot.statistics("filename"):
+            stage = GetFileStage(stat.traceback[0].filename)
+            blocks, size = byStage.get(stage, (0, 0))
+            byStage[stage] = (blocks + stat.count, size + stat.size)
+        return byStage
+
+    def WriteReport(self, sFileName, nTop=10):
+        if self.fStart is None:
+            return # session never started
+        if self.fStop is None:
+            self.Stop()
+        fTotal = max(self.fStop - self.fStart, 1e-9)
+
+        lines = []
+        lines.append("Capture session profile, %.3f s wall time" % fTotal)
+        lines.append("")
+        lines.append("%-16s %10s %12s %10s %7s" % ("stage", "calls", "total [s]", "mean [us]", "share"))
+        stageTimes = self.getStageTimes()
+        for stage in STAGES:
+            calls, seconds = stageTimes[stage]
+            mean = 1e6 * seconds / max(calls, 1)
+            lines.append("%-16s %10d %12.3f %10.1f %6.1f%%" % (stage, calls, seconds, mean, 100.0 * seconds / fTotal))
+
+        lines.append("")
+        allocations = self.getAllocationsByStage()
+        if not allocations is None:
+            lines.append("Allocations during the first %.1f s (tracemalloc)" % self.fWindow)
+            for stage in STAGES + [STAGE_OTHER]:
+                blocks, size = allocations.get(stage, (0, 0))
+                lines.append("%-16s %10d blocks %12d bytes" % (stage, blocks, size))
+        elif not self.objectGrowth is None:
+            lines.append("Objects allocated and still alive after the first %.1f s (gc, by class)" % self.fWindow)
+            growth = sorted([(n, name) for name, n in self.objectGrowth.items() if n != 0], reverse=True)
+            for n, name in growth[:nTop]:
+                lines.append("  %+10d  %s" % (n, name))
+        if not self.peakRss is None:
+            lines.append("Peak resident set size after the first %.1f s: %d kB" % (self.fWindow, self.peakRss))
+
+        lines.append("")
+        lines.append("Top functions by own time during the first %.1f s (cProfile)" % self.fWindow)
+        byStage = self.getProfileByStage()
+        for stage in STAGES + [STAGE_OTHER]:
+            entries = byStage.get(stage, [])
+            lines.append("[%s] %.3f s" % (stage, sum([e[0] for e in entries])))
+            for tt, nc, function in entries[:nTop]:
+                lines.append("  %10.6f s %8d  %s" % (tt, nc, function))
+
+        f = open(sFileName, "w")
+        try:
+            f.write("\n".join(lines) + "\n")
+        finally:
+            f.close()
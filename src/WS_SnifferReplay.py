@@ -0,0 +1,238 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+#
+# Description :
+#    This file implements replay of previously captured frames into the
+#    Wireshark named pipe, e.g. for load testing of dissectors.
+#
+#    The cWS_SnifferReplayAdapter reads a libpcap file (as written by the
+#    802.15.4 or ZEPv1 pcap wrappers) or a raw ZTC log (the byte stream
+#    received from the sniffer device) and turns the records back into
+#    cSnifferDataFrm's. Nanosecond libpcap and pcapng files are rejected,
+#    as is a file without any frame. The cWS_SnifferReplay writes them
+#    through one of the pcap wrappers with original timing, a speed
+#    multiplier or as fast as possible.
+#
+###############################################################################
+#
+# $Id$
+# $Date$
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import struct, time
+from WS_SnifferAdapterFreescale import cSnifferDataFrm, ZTC_STX
+from WS_SnifferLibPcapWrapper import TCPDUMP_MAGIC, DLT_IEEE802_15_4, MICROS_PER_SYMBOL
+from WS_SnifferLibPcapZepWrapper import DLT_IPV4, ZEPV1_HDR_LEN
+
+TCPDUMP_MAGIC_SWAPPED = 0xd4c3b2a1
+NSEC_TCPDUMP_MAGIC  = 0xa1b23c4d # nanosecond libpcap format, both byte orders
+NSEC_TCPDUMP_MAGIC_SWAPPED = 0x4d3cb2a1
+PCAPNG_MAGIC        = 0x0a0d0d0a # pcapng section header block type
+
+IPV4_HDR_LEN        = 20
+UDP_HDR_LEN         = 8
+
+SNIFFER_DATA_OPCODE_GRP = 0x86
+SNIFFER_DATA_OPCODE     = 0x03
+
+TIMESTAMP_WRAP      = 1 << 32 # sniffer time stamps are u32 symbol counts
+
+def MakeSnifferDataFrm(timestamp, lqi, msdu):
+    """ Builds a cSnifferDataFrm equal to the one received from the device """
+    payload = struct.pack("<BLB", lqi, timestamp, len(msdu)) + msdu
+    return cSnifferDataFrm(SNIFFER_DATA_OPCODE_GRP, SNIFFER_DATA_OPCODE,
+                           len(payload), payload)
+
+class cWS_SnifferReplayAdapter:
+    """ Loads all frames of a capture file into memory, so that disk I/O does
+        not disturb the replay timing. Records are (dataFrm, channel) tuples.
+    """
+#==============================================================================
+    def __init__(self, sFileName, defaultChannel=0):
+        self.sFileName = sFileName
+        self.defaultChannel = defaultChannel
+        self.records = []
+
+        f = open(sFileName, "rb")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        magic = None
+        if len(data) >= 4:
+            magic = struct.unpack("<L", data[0:4])[0]
+        if magic in (NSEC_TCPDUMP_MAGIC, NSEC_TCPDUMP_MAGIC_SWAPPED):
+            raise IOError("'%s' is a nanosecond libpcap file, only microsecond libpcap files are supported" % sFileName)
+        if magic == PCAPNG_MAGIC:
+            raise IOError("'%s' is a pcapng file, save it as libpcap to replay it" % sFileName)
+        if magic in (TCPDUMP_MAGIC, TCPDUMP_MAGIC_SWAPPED):
+            self.LoadPcap(data)
+        else:
+            self.LoadZtcLog(data)
+        if not self.records:
+            raise IOError("no frames found in '%s'" % sFileName)
+
+    def getFileName(self):
+        return self.sFileName
+
+    def getRecords(self):
+        return self.records
+
+    def LoadPcap(self, data):
+        if struct.unpack("<L", data[0:4])[0] == TCPDUMP_MAGIC:
+            endian = "<"
+        else:
+            endian = ">"
+        assert len(data) >= 24, "LoadPcap: truncated file header"
+        linkType = struct.unpack(endian + "L", data[20:24])[0]
+        assert linkType in (DLT_IEEE802_15_4, DLT_IPV4), "LoadPcap: unsupported link type %d" % linkType
+
+        sPktHdr = struct.Struct(endian + "2l 2L")
+        offset = 24
+        while offset + sPktHdr.size <= len(data):
+            secs, micros, inclLen, origLen = sPktHdr.unpack_from(data, offset)
+            offset += sPktHdr.size
+            pkt = data[offset:offset + inclLen]
+            offset += inclLen
+            if len(pkt) < inclLen:
+                break # truncated capture
+
+            timestamp = ((secs * 1000000 + micros) // MICROS_PER_SYMBOL) % TIMESTAMP_WRAP
+            if linkType == DLT_IEEE802_15_4:
+                self.records.append((MakeSnifferDataFrm(timestamp, 0, pkt), self.defaultChannel))
+            else:
+                zep = pkt[IPV4_HDR_LEN + UDP_HDR_LEN:]
+                if len(zep) < ZEPV1_HDR_LEN:
+                    continue
+                channel = ord(zep[3])
+                lqi = ord(zep[7])
+                pduLen = ord(zep[15])
+                # strip the two FCS octets (RSSI/correlation) added by the ZEP wrapper
+                msdu = zep[ZEPV1_HDR_LEN:ZEPV1_HDR_LEN + pduLen - 2]
+                self.records.append((MakeSnifferDataFrm(timestamp, lqi, msdu), channel))
+
+    def LoadZtcLog(self, data):
+        offset = 0
+        while offset + 5 <= len(data):
+            if ord(data[offset]) != ZTC_STX:
+                offset += 1 # resynchronise on the next STX
+                continue
+            opCodeGrp = ord(data[offset + 1])
+            opCode = ord(data[offset + 2])
+            payloadLen = ord(data[offset + 3])
+            end = offset + 4 + payloadLen
+            if end >= len(data):
+                break # truncated log
+            payload = data[offset + 4:end]
+            fcs = ord(data[end])
+            dataFrm = cSnifferDataFrm(opCodeGrp, opCode, payloadLen, payload)
+            if fcs != dataFrm.getFCS():
+                offset += 1
+                continue
+            offset = end + 1
+            if (opCodeGrp, opCode) == (SNIFFER_DATA_OPCODE_GRP, SNIFFER_DATA_OPCODE):
+                self.records.append((dataFrm, self.defaultChannel))
+
+class cWS_SnifferReplay:
+    """ Writes replay records through a pcap wrapper.
+
+        speed is a multiplier on the original timing (1.0 = original timing),
+        0 replays as fast as possible. loops is the number of passes over the
+        records, 0 loops forever.
+    """
+#==============================================================================
+    def __init__(self, records, speed=1.0, loops=1):
+        self.records = records
+        self.speed = speed
+        self.loops = loops
+
+        self.nRecords = 0
+        self.fElapsed = 0.0
+        self.fStall = 0.0
+
+    def Run(self, pipeWrapper, onFrame=None):
+        """ onFrame(dataFrm, channel) is called after each record is written """
+        start = time.time()
+        loop = 0
+        try:
+            while self.loops == 0 or loop < self.loops:
+                self.RunOnce(pipeWrapper, onFrame)
+                loop += 1
+        finally:
+            self.fElapsed = time.time() - start
+
+    def RunOnce(self, pipeWrapper, onFrame=None):
+        # time only the pipe write, not the encapsulation, where the wrapper allows
+        encodeRecord = getattr(pipeWrapper, "EncodeRecord", None)
+        prevTs = None
+        offset = 0.0 # seconds of capture time since the first record
+        start = time.time()
+        for dataFrm, channel in self.records:
+            if self.speed > 0:
+                ts = dataFrm.getTimeStamp()
+                if prevTs is not None:
+                    offset += ((ts - prevTs) % TIMESTAMP_WRAP) * MICROS_PER_SYMBOL / 1000000.0
+                prevTs = ts
+                delay = start + offset / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if encodeRecord is None:
+                before = time.time()
+                pipeWrapper.WriteRecord(dataFrm, channel)
+            else:
+                record = encodeRecord(dataFrm, channel)
+                before = time.time()
+                pipeWrapper.WritePipe(record)
+            self.fStall += time.time() - before
+            self.nRecords += 1
+            if not onFrame is None:
+                onFrame(dataFrm, channel)
+
+    def getNumRecords(self):
+        return self.nRecords
+
+    def getRecordsPerSec(self):
+        if self.fElapsed <= 0:
+            return 0.0
+        return self.nRecords / self.fElapsed
+
+    def getStallTime(self):
+        """ returns the total time in seconds spent blocked in pipe writes
+            (in WriteRecord for sinks without EncodeRecord)
+        """
+        return self.fStall
+
+    def getReport(self):
+        return "Replayed %d records in %.3f s (%.1f records/s), pipe stall %.3f s" % (
+            self.nRecords, self.fElapsed, self.getRecordsPerSec(), self.fStall)
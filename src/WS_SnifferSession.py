@@ -0,0 +1,402 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements session configuration files, describing one or
+#    more captures run concurrently in one process. Example:
+#
+#        [capture:coordinator]
+#        adapter = mc1322x              ; or replay (with file, speed, loops)
+#        port = COM8
+#        channels = 11,15,20,25         ; one channel, or a scan plan
+#        scan_interval = 30             ; s per channel of the plan
+#        scan_lock = no                 ; stop scanning on the first frame
+#        encap = zepv1                  ; for pipe and file sinks
+#        sinks = pipe:\\.\pipe\ws_coordinator,
+#                file:coordinator.pcap,
+#                udp:127.0.0.1:17754,
+#                export:jsonl:coordinator.jsonl
+#        queue_size = 1024              ; frames buffered per sink
+#        batch_size = 64                ; frames written per sink write
+#
+#    The file is validated completely at startup. Every capture runs a
+#    receive thread, feeding a bounded queue per sink, and a thread per
+#    sink writing batches of frames, so a pipe waiting for Wireshark does
+#    not hold up the other sinks. For pipe and file sinks the records of a
+#    batch are joined into a single write. Frames arriving while a sink's
+#    queue is full are dropped for that sink and counted (replays wait).
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import os, sys, time, threading, Queue, ConfigParser
+import WS_SnifferAdapterFreescale
+import WS_SnifferLibPcapEncap
+import WS_SnifferLibPcapZepWrapper
+import WS_SnifferExportWrapper
+import WS_SnifferReplay
+
+SECTION_PREFIX      = "capture:"
+ADAPTERS            = ["mc1322x", "replay"]
+ENCAP               = WS_SnifferLibPcapEncap.ENCAP
+
+SINK_WAITING        = "waiting" # in OpenPipe()
+SINK_OPEN           = "open"
+SINK_ABORTED        = "aborted" # stopped while waiting
+SINK_CLOSED         = "closed"
+
+CAPTURE_DEFAULTS = {
+    "adapter":          "mc1322x",
+    "port":             "",
+    "channels":         "",
+    "scan_interval":    "30",
+    "scan_lock":        "no",
+    "encap":            "802.15.4",
+    "sinks":            "pipe",
+    "queue_size":       "1024",
+    "batch_size":       "64",
+    "rx_timeout":       "1.0",
+    "file":             "",
+    "speed":            "1.0",
+    "loops":            "1",
+}
+
+def ParseSink(spec, encap, batchSize=64, queueSize=1024):
+    """ returns a sink (pipe wrapper interface) for a sink specification;
+        batchSize and queueSize (in frames) size the queue of export sinks
+    """
+    kind, sep, value = spec.partition(":")
+    if kind == "pipe":
+        if value:
+            return ENCAP[encap](value)
+        return ENCAP[encap]()
+    elif kind == "file" and value:
+        return ENCAP[encap](value, bFile=True)
+    elif kind == "udp" and value:
+        sHost, sep, port = value.partition(":")
+        if port:
+            if not port.isdigit():
+                raise ValueError("invalid port in sink '%s'" % spec)
+            return WS_SnifferLibPcapZepWrapper.cWS_ZEPv1_UdpWrapper(sHost, int(port))
+        return WS_SnifferLibPcapZepWrapper.cWS_ZEPv1_UdpWrapper(sHost)
+    elif kind == "export":
+        format, sep, sFileName = value.partition(":")
+        if format in WS_SnifferExportWrapper.EXPORT_FORMATS and sFileName:
+            return WS_SnifferExportWrapper.cWS_SnifferExportWrapper(sFileName, format,
+                batchSize, max(queueSize // batchSize, 1))
+    raise ValueError("unsupported sink '%s'" % spec)
+
+def LoadSessionFile(sFileName):
+    """ returns (captures, errors); captures is a list of validated
+        configuration dicts, errors a list of messages
+    """
+    parser = ConfigParser.RawConfigParser(CAPTURE_DEFAULTS)
+    errors = []
+    captures = []
+    try:
+        if not parser.read(sFileName):
+            return [], ["cannot read session file '%s'" % sFileName]
+    except ConfigParser.Error, err:
+        return [], [str(err)]
+
+    sections = [s for s in parser.sections() if s.startswith(SECTION_PREFIX)]
+    if not sections:
+        errors.append("no [%s<name>] sections in '%s'" % (SECTION_PREFIX, sFileName))
+    ports = {}
+    pipes = {}
+    for section in sections:
+        def error(msg):
+            errors.append("[%s] %s" % (section, msg))
+        get = lambda option: parser.get(section, option).strip()
+
+        capture = {"name": section[len(SECTION_PREFIX):]}
+        capture["adapter"] = get("adapter")
+        if not capture["adapter"] in ADAPTERS:
+            error("unsupported adapter '%s'" % capture["adapter"])
+        capture["port"] = get("port")
+        capture["file"] = get("file")
+        if capture["adapter"] == "mc1322x":
+            if not capture["port"]:
+                error("port is required")
+            elif capture["port"] in ports:
+                error("port %s already used by [%s]" % (capture["port"], ports[capture["port"]]))
+            ports[capture["port"]] = section
+        elif capture["adapter"] == "replay" and not os.path.isfile(capture["file"]):
+            error("replay file '%s' not found" % capture["file"])
+
+        # every option is checked on its own, so that all errors are reported
+        capture["channels"] = []
+        for c in get("channels").replace(",", " ").split():
+            try:
+                c = int(c)
+            except ValueError:
+                error("invalid channel '%s'" % c)
+                continue
+            if c < 11 or c > 26:
+                error("channel %d not in 11..26" % c)
+            capture["channels"].append(c)
+        if not get("channels") and capture["adapter"] == "mc1322x":
+            error("channels is required")
+        if not capture["channels"]:
+            capture["channels"] = [0] # replay of a ZTC log without channel
+
+        for option, key, getter in (("scan_interval", "scanInterval", parser.getfloat),
+                                    ("scan_lock", "scanLock", parser.getboolean),
+                                    ("rx_timeout", "rxTimeout", parser.getfloat),
+                                    ("speed", "speed", parser.getfloat),
+                                    ("loops", "loops", parser.getint),
+                                    ("queue_size", "queueSize", parser.getint),
+                                    ("batch_size", "batchSize", parser.getint)):
+            try:
+                capture[key] = getter(section, option)
+            except ValueError:
+                error("invalid %s '%s'" % (option, get(option)))
+                capture[key] = None
+                continue
+            if key in ("scanInterval", "rxTimeout", "queueSize", "batchSize") and capture[key] <= 0:
+                error("%s must be positive" % option)
+                capture[key] = None
+
+        capture["encap"] = get("encap")
+        if not capture["encap"] in ENCAP:
+            error("unsupported encapsulation '%s'" % capture["encap"])
+            continue
+        capture["sinks"] = [spec.strip() for spec in get("sinks").replace("\n", ",").split(",") if spec.strip()]
+        if not capture["sinks"]:
+            error("no sinks")
+        for spec in capture["sinks"]:
+            try:
+                sink = ParseSink(spec, capture["encap"])
+            except ValueError, err:
+                error(str(err))
+                continue
+            name = sink.getPipeName()
+            if name in pipes:
+                error("sink %s already used by [%s]" % (name, pipes[name]))
+            pipes[name] = section
+        captures.append(capture)
+    return captures, errors
+
+class cWS_SnifferCapture:
+    """ One capture of a session: a receive thread and a thread per sink """
+#==============================================================================
+    def __init__(self, config):
+        self.config = config
+        self.name = config["name"]
+        self.sinks = [ParseSink(spec, config["encap"], config["batchSize"], config["queueSize"])
+                      for spec in config["sinks"]]
+        self.queues = [Queue.Queue(config["queueSize"]) for sink in self.sinks]
+        self.sinkStates = [SINK_WAITING for sink in self.sinks]
+        self.running = False
+        self.channel = config["channels"][0]
+        self.nReceived = 0
+        self.nDropped = [0 for sink in self.sinks]
+        self.error = None
+        self.bStopped = False
+        self.threads = []
+
+    def Start(self):
+        self.running = True
+        threads = [threading.Thread(target=self.ReceiveThread, name="%s receive" % self.name)]
+        for k in range(len(self.sinks)):
+            threads.append(threading.Thread(target=self.SinkThread, args=(k,), name="%s sink %d" % (self.name, k)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def Stop(self):
+        """ may be repeated, in case a sink thread had not created its pipe yet """
+        self.running = False
+        self.bStopped = True
+        # release pipes still waiting for Wireshark, their thread then removes the FIFO
+        for k, sink in enumerate(self.sinks):
+            if self.sinkStates[k] in (SINK_WAITING, SINK_ABORTED) and hasattr(sink, "AbortOpenPipe"):
+                self.sinkStates[k] = SINK_ABORTED
+                sink.AbortOpenPipe()
+
+    def Join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def isAlive(self):
+        return len([t for t in self.threads if t.isAlive()]) > 0
+
+    def Enqueue(self, dataFrm, channel, block=False):
+        """ queues the frame for every sink; a full queue drops it for that
+            sink, unless block is set (replay)
+        """
+        self.nReceived += 1
+        for k, queue in enumerate(self.queues):
+            while self.sinkStates[k] != SINK_CLOSED:
+                try:
+                    queue.put((dataFrm, channel), block and self.running, 0.5)
+                    break
+                except Queue.Full:
+                    if not block or not self.running:
+                        self.nDropped[k] += 1
+                        break
+
+    def ReceiveThread(self):
+        try:
+            if self.config["adapter"] == "replay":
+                self.Replay()
+            else:
+                self.Capture()
+        except Exception, err:
+            self.error = str(err)
+            sys.stderr.write("[%s] ERROR: %s\n" % (self.name, self.error))
+            sys.stderr.flush()
+            self.Stop() # pipes waiting for Wireshark would never see a frame
+        self.running = False
+
+    def Replay(self):
+        adapter = WS_SnifferReplay.cWS_SnifferReplayAdapter(self.config["file"], self.channel)
+        replay = WS_SnifferReplay.cWS_SnifferReplay(adapter.getRecords(), self.config["speed"], self.config["loops"])
+        capture = self
+        class cStopReplay(Exception):
+            pass
+        class cEnqueue:
+            def WriteRecord(self, dataFrm, channel):
+                if not capture.running:
+                    raise cStopReplay()
+                capture.Enqueue(dataFrm, channel, True)
+        try:
+            replay.Run(cEnqueue())
+        except cStopReplay:
+            pass
+
+    def Capture(self):
+        channels = self.config["channels"]
+        snifferAdapter = WS_SnifferAdapterFreescale.cWS_SnifferWrapperMC1322x(
+            self.config["port"], self.channel, self.config["rxTimeout"])
+        try:
+            before = time.time()
+            i = 0
+            while self.running:
+                dataFrm = snifferAdapter.RcvDataFrame()
+                if not dataFrm is None:
+                    self.Enqueue(dataFrm, self.channel)
+
+                lock = len(channels) == 1 or (self.nReceived > 0 and self.config["scanLock"])
+                if not lock and time.time() - before >= self.config["scanInterval"]:
+                    before = time.time()
+                    i = (i + 1) % len(channels)
+                    self.channel = channels[i]
+                    snifferAdapter.ChangeLogicalChannel(self.channel)
+        finally:
+            snifferAdapter.s.close()
+
+    def SinkThread(self, k):
+        sink = self.sinks[k]
+        queue = self.queues[k]
+        try:
+            if self.bStopped:
+                return
+            sink.OpenPipe() # a pipe waits here for Wireshark, frames queue up meanwhile
+            if self.sinkStates[k] == SINK_ABORTED:
+                return
+            sink.WriteFileHeader()
+            self.sinkStates[k] = SINK_OPEN
+
+            while self.running or not queue.empty():
+                try:
+                    batch = [queue.get(True, 0.5)]
+                except Queue.Empty:
+                    continue
+                while len(batch) < self.config["batchSize"]:
+                    try:
+                        batch.append(queue.get_nowait())
+                    except Queue.Empty:
+                        break
+                self.WriteBatch(sink, batch)
+        except Exception, err:
+            if self.sinkStates[k] == SINK_OPEN:
+                # For now: assume pipe closed by Wireshark
+                print "[%s] sink '%s' closed" % (self.name, sink.getPipeName())
+            else:
+                self.error = str(err)
+        finally:
+            self.sinkStates[k] = SINK_CLOSED
+            try:
+                sink.ClosePipe()
+            except Exception:
+                pass
+            if not [state for state in self.sinkStates if state != SINK_CLOSED]:
+                self.running = False # no sink left
+
+    def WriteBatch(self, sink, batch):
+        if hasattr(sink, "EncodeRecord"):
+            # join the records of the batch into a single write
+            sink.WritePipe("".join([sink.EncodeRecord(dataFrm, channel) for dataFrm, channel in batch]))
+        else:
+            for dataFrm, channel in batch:
+                sink.WriteRecord(dataFrm, channel)
+
+    def getStatus(self):
+        status = "[%s] channel %d: %d received" % (self.name, self.channel, self.nReceived)
+        for k, sink in enumerate(self.sinks):
+            status += "; sink '%s' %s, %d dropped (queue full)" % (sink.getPipeName(), self.sinkStates[k], self.nDropped[k])
+        if not self.error is None:
+            status += ", error: %s" % self.error
+        return status
+
+def RunSession(sFileName):
+    """ runs all captures of a session file until they end or Ctrl+C """
+    configs, errors = LoadSessionFile(sFileName)
+    if errors:
+        return errors
+
+    captures = [cWS_SnifferCapture(config) for config in configs]
+    for capture in captures:
+        print "[%s] %s on %s, channels %s, sinks %s" % (capture.name, capture.config["adapter"],
+            capture.config["port"] or capture.config["file"],
+            ",".join([str(c) for c in capture.config["channels"]]), ", ".join(capture.config["sinks"]))
+        capture.Start()
+    try:
+        while len([c for c in captures if c.isAlive()]) > 0:
+            time.sleep(0.5)
+            for capture in captures:
+                if capture.bStopped and capture.isAlive():
+                    capture.Stop()
+    except KeyboardInterrupt:
+        print " Caught"
+        for capture in captures:
+            capture.Stop()
+        for capture in captures:
+            capture.Join(5.0)
+    for capture in captures:
+        print capture.getStatus()
+    return []
@@ -0,0 +1,276 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements a pre-trigger capture mode. Received frames are
+#    kept in a fixed-memory ring holding the last N seconds or N bytes of
+#    traffic. When a trigger matches (MAC frame type, address, unsecured
+#    Zigbee NWK command or an external signal), the ring is dumped to a
+#    libpcap file, followed by the frames of a post-trigger window.
+#
+#    The ring stores the raw ZTC frames in one preallocated bytearray with
+#    per frame offsets, lengths, arrival times and channels in fixed size
+#    arrays, so memory use does not grow with the capture time. The index
+#    is sized for frames of AVG_RECORD_LEN bytes (15 bytes per entry, about
+#    30% on top of the ring); when smaller frames fill it up, the oldest
+#    records are dropped before the ring bytes run out.
+#
+#    The cWS_SnifferTriggerRing has the same interface as the pcap
+#    wrappers, with the pipe name being the base name of the dump files.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import array, struct, time
+import WS_SnifferLibPcapWrapper
+from WS_SnifferAdapterFreescale import cSnifferDataFrm
+from WS_SnifferMacHeader import ParseMacHeader, GetMacHeaderLen, MAC_FRAME_DATA
+
+MAC_FRAME_TYPES = {"beacon": 0, "data": 1, "ack": 2, "cmd": 3}
+
+AVG_RECORD_LEN      = 48 # bytes, ZTC header and a short data frame; sizes the ring index
+
+NWK_FRAME_CMD       = 1
+NWK_FC_MULTICAST    = 0x0100
+NWK_FC_SECURITY     = 0x0200
+NWK_FC_SOURCE_ROUTE = 0x0400
+NWK_FC_DST_IEEE     = 0x0800
+NWK_FC_SRC_IEEE     = 0x1000
+
+def GetNwkCommandId(msdu):
+    """ returns the Zigbee NWK command identifier of an unsecured NWK command
+        frame, or None (NWK commands are normally secured and not visible)
+    """
+    if len(msdu) < 3 or (ord(msdu[0]) & 0x07) != MAC_FRAME_DATA:
+        return None
+    try:
+        p = GetMacHeaderLen(msdu)
+        if p is None:
+            return None
+        nwkFc = struct.unpack_from("<H", msdu, p)[0]
+        if (nwkFc & 0x03) != NWK_FRAME_CMD or (nwkFc & NWK_FC_SECURITY):
+            return None
+        p += 8 # frame control, destination, source, radius, sequence number
+        if nwkFc & NWK_FC_DST_IEEE:
+            p += 8
+        if nwkFc & NWK_FC_SRC_IEEE:
+            p += 8
+        if nwkFc & NWK_FC_MULTICAST:
+            p += 1
+        if nwkFc & NWK_FC_SOURCE_ROUTE:
+            p += 2 + 2 * ord(msdu[p])
+        return ord(msdu[p])
+    except (struct.error, IndexError):
+        return None
+
+def ParseTrigger(spec):
+    """ returns a trigger function(msdu) for a trigger specification:
+
+        type:<beacon|data|ack|cmd>   MAC frame type
+        addr:<hex address>           MAC source or destination address
+        nwk:<command id>             unsecured Zigbee NWK command, e.g. nwk:4 (leave)
+    """
+    kind, sep, value = spec.partition(":")
+    if kind == "type":
+        frameType = MAC_FRAME_TYPES.get(value)
+        if frameType is None:
+            frameType = int(value, 0)
+        return lambda msdu: len(msdu) > 0 and (ord(msdu[0]) & 0x07) == frameType
+    elif kind == "addr":
+        addr = value.lower().replace(":", "")
+        if addr.startswith("0x"):
+            addr = addr[2:]
+        def matchAddr(msdu):
+            hdr = ParseMacHeader(msdu)
+            return hdr is not None and (hdr[3] == addr or hdr[5] == addr)
+        return matchAddr
+    elif kind == "nwk":
+        commandId = int(value, 0)
+        return lambda msdu: GetNwkCommandId(msdu) == commandId
+    raise ValueError("unsupported trigger '%s'" % spec)
+
+class cWS_SnifferRingBuffer:
+    """ Fixed-memory ring of raw frames, bounded by bytes and by age """
+#==============================================================================
+    def __init__(self, maxBytes, maxSeconds=None):
+        self.maxSeconds = maxSeconds
+        self.buf = bytearray(maxBytes)
+        capacity = max(maxBytes // AVG_RECORD_LEN, 1)
+        self.offsets = array.array("I", [0]) * capacity
+        self.lengths = array.array("H", [0]) * capacity
+        self.times = array.array("d", [0.0]) * capacity
+        self.channels = array.array("B", [0]) * capacity
+        self.Clear()
+
+    def Clear(self):
+        self.first = 0 # index of the oldest record
+        self.count = 0
+        self.head = 0 # byte offset of the next record
+
+    def Add(self, binFrm, channel, now):
+        n = len(binFrm)
+        size = len(self.buf)
+        if n > size:
+            return
+        capacity = len(self.offsets)
+        if self.head + n > size:
+            # records never wrap, the tail is left unused. The records behind
+            # the head are the oldest ones; drop them all before writing at
+            # the start, or they would outlive the newer records overwritten there
+            while self.count > 0 and self.offsets[self.first] >= self.head:
+                self.first = (self.first + 1) % capacity
+                self.count -= 1
+            self.head = 0
+
+        start = self.head
+        end = start + n
+        # evict the oldest records overlapping the new one, or out of index space
+        while self.count > 0:
+            i = self.first
+            off = self.offsets[i]
+            if self.count < capacity and not (off < end and off + self.lengths[i] > start):
+                break
+            self.first = (i + 1) % capacity
+            self.count -= 1
+        if not self.maxSeconds is None:
+            while self.count > 0 and now - self.times[self.first] > self.maxSeconds:
+                self.first = (self.first + 1) % capacity
+                self.count -= 1
+
+        i = (self.first + self.count) % capacity
+        self.buf[start:end] = binFrm
+        self.offsets[i] = start
+        self.lengths[i] = n
+        self.times[i] = now
+        self.channels[i] = channel
+        self.count += 1
+        self.head = end
+
+    def getRecords(self):
+        """ returns the buffered frames, oldest first, as (dataFrm, channel) tuples """
+        records = []
+        capacity = len(self.offsets)
+        for k in range(self.count):
+            i = (self.first + k) % capacity
+            off = self.offsets[i]
+            binFrm = str(self.buf[off:off + self.lengths[i]])
+            dataFrm = cSnifferDataFrm(ord(binFrm[0]), ord(binFrm[1]), ord(binFrm[2]), binFrm[3:])
+            records.append((dataFrm, self.channels[i]))
+        return records
+
+    def getNumRecords(self):
+        return self.count
+
+class cWS_SnifferTriggerRing:
+    """ Pre-trigger capture sink. Trigger() may also be called from a signal
+        handler; the dump then starts with the next received frame or Poll().
+    """
+#==============================================================================
+    def __init__(self, sBaseName, triggers, maxBytes=4 * 1024 * 1024, maxSeconds=None,
+                 postSeconds=10.0, wrapperClass=WS_SnifferLibPcapWrapper.cWS_IEEE802_15_4_LibPcapWrapper):
+        self.sBaseName = sBaseName
+        self.triggers = triggers
+        self.ring = cWS_SnifferRingBuffer(maxBytes, maxSeconds)
+        self.postSeconds = postSeconds
+        self.wrapperClass = wrapperClass
+
+        self.triggered = False
+        self.dumpWrapper = None
+        self.dumpEnd = None
+        self.dumpFileNames = []
+
+    def OpenPipe(self):
+        pass
+
+    def ClosePipe(self):
+        self.CloseDump()
+
+    def getPipeName(self):
+        return self.sBaseName
+
+    def WriteFileHeader(self):
+        pass
+
+    def Trigger(self):
+        self.triggered = True
+
+    def WriteRecord(self, snifferDataFrm, channel):
+        now = time.time()
+        if not self.dumpWrapper is None:
+            self.dumpWrapper.WriteRecord(snifferDataFrm, channel)
+            if now >= self.dumpEnd:
+                self.CloseDump()
+            return
+
+        self.ring.Add(snifferDataFrm.getBinFrm(), channel, now)
+        if not self.triggered:
+            msdu = snifferDataFrm.getMsdu()
+            for trigger in self.triggers:
+                if trigger(msdu):
+                    self.triggered = True
+                    break
+        if self.triggered:
+            self.OpenDump(now)
+
+    def Poll(self):
+        """ to be called when no frame was received, handles signals and the post-trigger window end """
+        now = time.time()
+        if not self.dumpWrapper is None:
+            if now >= self.dumpEnd:
+                self.CloseDump()
+        elif self.triggered:
+            self.OpenDump(now)
+
+    def OpenDump(self, now):
+        sFileName = "%s-%s-%d.pcap" % (self.sBaseName, time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+                                       len(self.dumpFileNames))
+        self.dumpWrapper = self.wrapperClass(sFileName, bFile=True)
+        self.dumpWrapper.OpenPipe()
+        self.dumpWrapper.WriteFileHeader()
+        for dataFrm, channel in self.ring.getRecords():
+            self.dumpWrapper.WriteRecord(dataFrm, channel)
+        self.ring.Clear()
+        self.dumpEnd = now + self.postSeconds
+        self.dumpFileNames.append(sFileName)
+        print "Trigger: dumping to '%s'" % sFileName
+
+    def CloseDump(self):
+        if not self.dumpWrapper is None:
+            self.dumpWrapper.ClosePipe()
+        self.dumpWrapper = None
+        self.triggered = False
+
+    def getDumpFileNames(self):
+        return self.dumpFileNames
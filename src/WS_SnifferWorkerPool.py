@@ -0,0 +1,242 @@
+################################################################################
+#
+# Copyright (c) 2011, Jakob Thomsen, marama.dk
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of MARAMA nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY MARAMA ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL MARAMA BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+# 
+# Description : 
+#    This file implements a pool of worker processes for per frame
+#    analysis, fed through a ring of frame slots in shared memory.
+#
+#    The receive loop copies the raw ZTC frame (as returned by
+#    RcvDataFrame), its channel and arrival time into the next slot; the
+#    frames themselves are never pickled. Slots are grouped in chunks of
+#    chunkSize frames, and chunks are dealt round robin to the workers,
+#    each owning every n'th chunk, with a pair of semaphores per worker for
+#    flow control. A worker runs the configured stage functions on every
+#    frame of a chunk and puts the list of their (small) results on its own
+#    result queue, so synchronisation and pickling are paid once per
+#    chunk, and reading the result queues round robin gathers the results
+#    in order.
+#
+#    An exception in a stage is sent back in place of the frame's results
+#    and raised by GetResult(), the worker carries on with the next frame.
+#    Put(), Close() and GetResult() wait with a timeout and raise instead
+#    of blocking forever once a worker process has died.
+#
+###############################################################################
+#
+# $Id$ 
+# $Date$   
+# $Rev$
+# $LastChangedBy$
+#
+###############################################################################
+
+import multiprocessing, time, Queue
+from multiprocessing.sharedctypes import RawArray
+from WS_SnifferAdapterFreescale import cSnifferDataFrm
+
+SLOT_SIZE           = 3 + 255 # ZTC header + max payload
+CHUNK_END           = 0xFFFF  # chunk length marking the end of the stream
+WORKER_CHECK_INTERVAL = 1.0   # s, between checks that a blocking worker is alive
+
+def WorkerMain(stages, buf, lengths, channels, times, chunkLens, chunkBase, nChunks, chunkSize,
+               free, filled, results):
+    """ worker process: runs stages(dataFrm, channel, arrivalTime) on every frame of its chunks """
+    k = 0
+    while 1:
+        filled.acquire()
+        c = chunkBase + k % nChunks
+        k += 1
+        n = chunkLens[c]
+        if n == CHUNK_END:
+            free.release()
+            results.put(None)
+            break
+        frames = []
+        for i in range(c * chunkSize, c * chunkSize + n):
+            off = i * SLOT_SIZE
+            frames.append((buf[off:off + lengths[i]], channels[i], times[i]))
+        free.release()
+
+        chunkResults = []
+        for binFrm, channel, arrivalTime in frames:
+            try:
+                dataFrm = cSnifferDataFrm(ord(binFrm[0]), ord(binFrm[1]), ord(binFrm[2]), binFrm[3:])
+                chunkResults.append([stage(dataFrm, channel, arrivalTime) for stage in stages])
+            except Exception, err:
+                # a string in place of the result list marks a failed frame
+                chunkResults.append("%s: %s" % (err.__class__.__name__, err))
+        results.put(chunkResults)
+
+class cWS_SnifferWorkerPool:
+    """ Shared memory frame ring with a pool of analysis processes.
+
+        Put() is called from the receive loop, GetResult() returns the stage
+        results of the frames in the order they were put, and None once the
+        pool has been closed and all results are read. Failures are raised
+        as RuntimeError. A partly filled chunk is only handed to its worker
+        by Flush() or Close().
+    """
+#==============================================================================
+    def __init__(self, stages, nWorkers=2, nChunksPerWorker=8, chunkSize=64):
+        self.nWorkers = nWorkers
+        self.nChunksPerWorker = nChunksPerWorker
+        self.chunkSize = chunkSize
+        nChunks = nWorkers * nChunksPerWorker
+
+        self.buf = RawArray("c", nChunks * chunkSize * SLOT_SIZE)
+        self.lengths = RawArray("H", nChunks * chunkSize)
+        self.channels = RawArray("B", nChunks * chunkSize)
+        self.times = RawArray("d", nChunks * chunkSize)
+        self.chunkLens = RawArray("H", nChunks)
+
+        self.free = [multiprocessing.Semaphore(nChunksPerWorker) for w in range(nWorkers)]
+        self.filled = [multiprocessing.Semaphore(0) for w in range(nWorkers)]
+        self.results = [multiprocessing.Queue() for w in range(nWorkers)]
+
+        self.workers = []
+        for w in range(nWorkers):
+            process = multiprocessing.Process(target=WorkerMain,
+                args=(stages, self.buf, self.lengths, self.channels, self.times, self.chunkLens,
+                      w * nChunksPerWorker, nChunksPerWorker, chunkSize,
+                      self.free[w], self.filled[w], self.results[w]),
+                name="analysis worker %d" % w)
+            process.daemon = True
+            process.start()
+            self.workers.append(process)
+
+        self.nPut = 0
+        self.nGot = 0
+        self.nChunksPut = 0
+        self.nChunksGot = 0
+        self.chunk = None # (worker, chunk index) being filled
+        self.nInChunk = 0
+        self.chunkResults = []
+        self.closed = False
+
+    def getChunk(self, k):
+        """ returns (worker, chunk index) of the k'th chunk """
+        w = k % self.nWorkers
+        return w, w * self.nChunksPerWorker + (k // self.nWorkers) % self.nChunksPerWorker
+
+    def AcquireChunk(self, w):
+        """ waits for a free chunk of worker w, returns False if the worker died """
+        while not self.free[w].acquire(True, WORKER_CHECK_INTERVAL):
+            if not self.workers[w].is_alive():
+                return False
+        return True
+
+    def Put(self, snifferDataFrm, channel, arrivalTime=None):
+        if arrivalTime is None:
+            arrivalTime = time.time()
+        if self.chunk is None:
+            w, c = self.getChunk(self.nChunksPut)
+            if not self.AcquireChunk(w): # blocks while the worker is a full ring behind
+                raise RuntimeError("analysis worker %d died (exit code %s)" % (w, self.workers[w].exitcode))
+            self.chunk = (w, c)
+        w, c = self.chunk
+
+        binFrm = snifferDataFrm.getBinFrm()
+        n = len(binFrm)
+        i = c * self.chunkSize + self.nInChunk
+        off = i * SLOT_SIZE
+        self.buf[off:off + n] = binFrm
+        self.lengths[i] = n
+        self.channels[i] = channel
+        self.times[i] = arrivalTime
+        self.nInChunk += 1
+        self.nPut += 1
+        if self.nInChunk == self.chunkSize:
+            self.Flush()
+
+    def Flush(self):
+        """ hands a partly filled chunk to its worker """
+        if self.chunk is None:
+            return
+        w, c = self.chunk
+        self.chunkLens[c] = self.nInChunk
+        self.filled[w].release()
+        self.chunk = None
+        self.nInChunk = 0
+        self.nChunksPut += 1
+
+    def Close(self):
+        """ ends the stream, pending frames are still processed; dead workers are skipped """
+        if self.closed:
+            return
+        self.closed = True
+        self.Flush()
+        for k in range(self.nChunksPut, self.nChunksPut + self.nWorkers):
+            w, c = self.getChunk(k)
+            if self.AcquireChunk(w):
+                self.chunkLens[c] = CHUNK_END
+                self.filled[w].release()
+
+    def GetResult(self):
+        if not self.chunkResults:
+            w = self.nChunksGot % self.nWorkers
+            while 1:
+                alive = self.workers[w].is_alive()
+                try:
+                    chunkResults = self.results[w].get(True, WORKER_CHECK_INTERVAL)
+                    break
+                except Queue.Empty:
+                    if not alive: # everything it sent had arrived before the get
+                        raise RuntimeError("analysis worker %d died (exit code %s)" % (w, self.workers[w].exitcode))
+            if chunkResults is None:
+                return None
+            self.nChunksGot += 1
+            chunkResults.reverse()
+            self.chunkResults = chunkResults
+        result = self.chunkResults.pop()
+        self.nGot += 1
+        if isinstance(result, str):
+            raise RuntimeError("analysis worker %d failed on frame %d: %s"
+                               % ((self.nChunksGot - 1) % self.nWorkers, self.nGot - 1, result))
+        return result
+
+    def isAlive(self):
+        """ returns True while all worker processes are running """
+        for process in self.workers:
+            if not process.is_alive():
+                return False
+        return True
+
+    def Join(self):
+        for process in self.workers:
+            process.join()
+
+    def Terminate(self):
+        """ stops the workers without waiting for pending frames """
+        for process in self.workers:
+            process.terminate()
+            process.join()
+
+    def getBacklog(self):
+        """ returns the number of frames put but not yet gathered """
+        return self.nPut - self.nGot
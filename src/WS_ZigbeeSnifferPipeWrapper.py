@@ -67,12 +67,98 @@ Parameters:
 
     --scan-lock
         Stop scanning after capturing the first packet 
+
+    --export=fileName
+        Write per frame records to fileName instead of the named pipe
+
+    --export-format
+        The export format, jsonl (default), csv or columns (one JSON
+        object of per field value arrays per batch)
+
+    --export-batch
+        The number of records formatted and written per batch (default 256)
+
+    --workers
+        The number of worker processes decoding and formatting export
+        records, and decoding frames for --survey and --loss, fed through
+        shared memory (default 0, in the capture process)
+
+    --ring=baseName
+        Keep received frames in a memory ring instead of writing them to
+        the named pipe. When a --trigger matches, the ring and the frames
+        of the post-trigger window are dumped to baseName-<time>-<n>.pcap.
+        On posix, SIGUSR1 triggers a dump as well
+
+    --ring-mb
+        The ring size in MB (default 4)
+
+    --ring-seconds
+        The maximum age, in seconds, of frames kept in the ring
+
+    --trigger=spec
+        A trigger for --ring, may be repeated: type:<beacon|data|ack|cmd>,
+        addr:<hex address> or nwk:<command id> (unsecured NWK commands)
+
+    --post-trigger
+        The interval, in seconds, captured after a trigger (default 10)
+
+    --survey=baseName
+        Aggregate per channel and per source LQI/RSSI statistics (requires
+        NumPy). Written to baseName.csv and baseName.json after every scan
+        cycle and on exit. On posix, SIGUSR2 writes them on demand
+
+    --loss=fileName
+        Estimate missed frames per channel and node from MAC sequence
+        number gaps, and count sniffer time stamp discontinuities (not for
+        --replay). Written to fileName (CSV) every --loss-interval and
+        summarised on exit
+
+    --loss-interval
+        The interval, in seconds, of the loss estimation rows (default 10)
+
+    --profile=reportFile
+        Time the capture loop per stage (adapter receive, encapsulation,
+        sink write, scan switching) and write a report on exit
+
+    --profile-window
+        The interval, in seconds, at the start of the session for which
+        cProfile and an allocation measurement (tracemalloc where
+        available, else object counts and peak RSS) also run (default 30)
+
+    --session=sessionFile
+        Run all captures defined in a session file concurrently, see
+        WS_SnifferSession.py for the format. Other parameters are ignored
+
+    --daemon=socketName
+        Run as a capture daemon controlled through the Unix socket
+        socketName (posix only). Devices stay configured and capturing
+        between Wireshark sessions. If --port and --channel are given
+        that device is opened at startup
+
+    --control=socketName command...
+        Send a control command to a running daemon and print the reply,
+        e.g. --control=/tmp/wsdaemon start COM8 /tmp/wireshark zepv1
+
+    --replay=captureFile
+        Replay a pcap file or raw ZTC log into the pipe instead of
+        capturing from a sniffer device (--port is not required)
+
+    --replay-speed=speed
+        Replay timing multiplier, 1 = original timing (default),
+        0 = as fast as possible
+
+    --replay-loops=loops
+        Number of passes over the capture file, 0 = forever (default 1)
 """
 
 import WS_SnifferAdapterFreescale
-import WS_SnifferLibPcapWrapper
-import WS_SnifferLibPcapZepWrapper
-import getopt, sys #, traceback
+import WS_SnifferLibPcapEncap
+import WS_SnifferReplay
+import WS_SnifferExportWrapper
+import WS_SnifferTriggerRing
+import WS_SnifferLossEstimator
+import WS_SnifferAnalysis
+import getopt, sys, signal, multiprocessing #, traceback
 from serial import SerialException
 import time
 #import binascii
@@ -91,12 +177,32 @@ def main():
     scan = False
     scanInterval = 30 * 1000 # 30s
     scanLock = False
+    replayFile = None
+    replaySpeed = 1.0
+    replayLoops = 1
+    surveyBaseName = None
+    lossFile = None
+    lossInterval = 10.0
+    profileFile = None
+    profileWindow = 30.0
+    sessionFile = None
+    daemonSocket = None
+    exportFile = None
+    exportFormat = "jsonl"
+    exportBatch = 256
+    nWorkers = 0
+    ringBaseName = None
+    ringMb = 4.0
+    ringSeconds = None
+    triggerSpecs = []
+    postTrigger = 10.0
+    controlSocket = None
     
-    ENCAP = ["802.15.4", "zepv1"]
+    ENCAP = WS_SnifferLibPcapEncap.ENCAP_NAMES
     encap = ENCAP[0]
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hv", ["help", "port=", "channel=", "encap=", "scan", "scan-interval=", "scan-lock", "verbose"])
+        opts, args = getopt.getopt(sys.argv[1:], "hv", ["help", "port=", "channel=", "encap=", "scan", "scan-interval=", "scan-lock", "export=", "export-format=", "export-batch=", "workers=", "ring=", "ring-mb=", "ring-seconds=", "trigger=", "post-trigger=", "survey=", "loss=", "loss-interval=", "profile=", "profile-window=", "replay=", "replay-speed=", "replay-loops=", "session=", "daemon=", "control=", "verbose"])
         
     except getopt.GetoptError, err:
         # print help information and exit:
@@ -120,10 +226,80 @@ def main():
             scanInterval = int(a) * 1000
         elif o in ("--scan-lock"):
             scanLock = True
+        elif o in ("--export"):
+            exportFile = a
+        elif o in ("--export-format"):
+            exportFormat = a
+        elif o in ("--export-batch"):
+            exportBatch = int(a)
+        elif o in ("--workers"):
+            nWorkers = int(a)
+        elif o in ("--ring"):
+            ringBaseName = a
+        elif o in ("--ring-mb"):
+            ringMb = float(a)
+        elif o in ("--ring-seconds"):
+            ringSeconds = float(a)
+        elif o in ("--trigger"):
+            triggerSpecs.append(a)
+        elif o in ("--post-trigger"):
+            postTrigger = float(a)
+        elif o in ("--survey"):
+            surveyBaseName = a
+        elif o in ("--loss"):
+            lossFile = a
+        elif o in ("--loss-interval"):
+            lossInterval = float(a)
+        elif o in ("--profile"):
+            profileFile = a
+        elif o in ("--profile-window"):
+            profileWindow = float(a)
+        elif o in ("--replay"):
+            replayFile = a
+        elif o in ("--replay-speed"):
+            replaySpeed = float(a)
+        elif o in ("--replay-loops"):
+            replayLoops = int(a)
+        elif o in ("--session"):
+            sessionFile = a
+        elif o in ("--daemon"):
+            daemonSocket = a
+        elif o in ("--control"):
+            controlSocket = a
         else:
             assert False, "unhandled option"
 
-    if (sPort is None) or (channel is None):
+    if (sessionFile is not None):
+        import WS_SnifferSession
+        errors = WS_SnifferSession.RunSession(sessionFile)
+        if errors:
+            usage("Invalid session file '%s':\n    %s" % (sessionFile, "\n    ".join(errors)))
+        return
+
+    if (controlSocket is not None):
+        import WS_SnifferDaemon
+        print WS_SnifferDaemon.SendCommand(controlSocket, " ".join(args))
+        return
+
+    if (daemonSocket is not None):
+        import WS_SnifferDaemon
+        daemon = WS_SnifferDaemon.cWS_SnifferDaemon()
+        if (sPort is not None) and (channel is not None):
+            print daemon.Command("open %s %d" % (sPort, channel))
+        print "Capture daemon listening on '%s'" % daemonSocket
+        try:
+            daemon.Serve(daemonSocket)
+        except IOError, err:
+            sys.stderr.write('ERROR: %s\n' % str(err))
+            print daemon.Command("shutdown")
+        except KeyboardInterrupt:
+            print daemon.Command("shutdown")
+        return
+
+    if (replayFile is not None) and (channel is None):
+        channel = 0 # only used for ZTC logs, which carry no channel
+
+    if ((sPort is None) and (replayFile is None)) or (channel is None):
         usage("You must specify both serial port and channel, e.g.\n\n%s --port=COM8 --channel=14" % sys.argv[0])
         sys.exit()
 
@@ -131,26 +307,108 @@ def main():
         usage("Unsupported encapsulation %s" % encap)
         sys.exit()
 
+    if (not exportFormat in WS_SnifferExportWrapper.EXPORT_FORMATS):
+        usage("Unsupported export format %s" % exportFormat)
+        sys.exit()
+
+    try:
+        triggers = [WS_SnifferTriggerRing.ParseTrigger(spec) for spec in triggerSpecs]
+    except ValueError, err:
+        usage(str(err))
+        sys.exit()
+
     if (scan):
         print "Scanning channels 11..26 starting from channel %d" % channel
 
+    survey = None
+    surveyRequest = [False] # set from the SIGUSR2 handler, exported between frames
+    if (surveyBaseName is not None):
+        import WS_SnifferLinkSurvey
+        survey = WS_SnifferLinkSurvey.cWS_SnifferLinkSurvey()
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, lambda signum, frame: surveyRequest.__setitem__(0, True))
+            signal.siginterrupt(signal.SIGUSR2, False) # restart pipe writes and serial reads
+
+    lossEstimator = None
+    if (lossFile is not None):
+        # replay timing is not the capture timing, so time stamps are not checked
+        lossEstimator = WS_SnifferLossEstimator.cWS_SnifferLossEstimator(lossFile, lossInterval, replayFile is None)
+
+    profiler = None
+    if (profileFile is not None):
+        import WS_SnifferProfiler
+        profiler = WS_SnifferProfiler.cWS_SnifferProfiler(profileWindow)
+
+    replay = None
+    if (replayFile is not None):
+        print "Loading capture file '%s' for replay" % replayFile
+        try:
+            replayAdapter = WS_SnifferReplay.cWS_SnifferReplayAdapter(replayFile, channel)
+        except (IOError, AssertionError), err:
+            sys.stderr.write('ERROR: %s\n' % str(err))
+            sys.exit(1)
+        replay = WS_SnifferReplay.cWS_SnifferReplay(replayAdapter.getRecords(), replaySpeed, replayLoops)
+        print "Loaded %d records" % len(replayAdapter.getRecords())
+
+    analysis = None
+    if (survey is not None) or (lossEstimator is not None):
+        analysis = WS_SnifferAnalysis.cWS_SnifferAnalysis(survey, lossEstimator, nWorkers)
+
+    def CheckSurveyRequest():
+        if surveyRequest[0]:
+            surveyRequest[0] = False
+            analysis.ExportSurvey(surveyBaseName)
+            print "Survey written to '%s.csv' and '%s.json'" % (surveyBaseName, surveyBaseName)
+
+    def OnFrame(dataFrm, channel):
+        """ per frame hooks, shared by the capture loop and replay """
+        if not analysis is None:
+            analysis.AddFrame(dataFrm, channel)
+        if not survey is None:
+            CheckSurveyRequest()
+
+    snifferAdapter = None
     pipeWrapper = None
     try:
-        # Connect to Zigbee sniffer device
-        print "Configuring sniffer on port '%s' to listen on channel %d" % (sPort, channel)
-        snifferAdapter = WS_SnifferAdapterFreescale.cWS_SnifferWrapperMC1322x(sPort, channel)
+        if (replay is None):
+            # Connect to Zigbee sniffer device
+            print "Configuring sniffer on port '%s' to listen on channel %d" % (sPort, channel)
+            snifferAdapter = WS_SnifferAdapterFreescale.cWS_SnifferWrapperMC1322x(sPort, channel)
         
         # Open named pipe to Wireshark
-        if (encap == ENCAP[0]): 
-            pipeWrapper = WS_SnifferLibPcapWrapper.cWS_IEEE802_15_4_LibPcapWrapper()
-        elif (encap == ENCAP[1]):
-            pipeWrapper = WS_SnifferLibPcapZepWrapper.cWS_ZEPv1_LibPcapWrapper()
+        if (ringBaseName is not None):
+            pipeWrapper = WS_SnifferTriggerRing.cWS_SnifferTriggerRing(ringBaseName, triggers,
+                int(ringMb * 1024 * 1024), ringSeconds, postTrigger, WS_SnifferLibPcapEncap.ENCAP[encap])
+            if hasattr(signal, "SIGUSR1"):
+                signal.signal(signal.SIGUSR1, lambda signum, frame: pipeWrapper.Trigger())
+                signal.siginterrupt(signal.SIGUSR1, False) # restart pipe writes and serial reads
+        elif (exportFile is not None):
+            pipeWrapper = WS_SnifferExportWrapper.cWS_SnifferExportWrapper(exportFile, exportFormat, exportBatch,
+                                                                         nWorkers=nWorkers)
+        else:
+            pipeWrapper = WS_SnifferLibPcapEncap.ENCAP[encap]()
 
-        print "Configure Wireshark to listen to the name pipe '%s'" % (pipeWrapper.getPipeName())
+        if (ringBaseName is not None):
+            print "Keeping frames in a %.1f MB ring, dumps to '%s-*.pcap'" % (ringMb, ringBaseName)
+        elif (exportFile is not None):
+            print "Exporting %s records to '%s'" % (exportFormat, exportFile)
+        else:
+            print "Configure Wireshark to listen to the name pipe '%s'" % (pipeWrapper.getPipeName())
         pipeWrapper.OpenPipe()
         
         # Write libpcap file header to pipe
         pipeWrapper.WriteFileHeader()
+
+        if (profiler is not None):
+            profiler.Instrument(snifferAdapter, pipeWrapper)
+            profiler.Start()
+
+        if (replay is not None):
+            if (analysis is None):
+                replay.Run(pipeWrapper)
+            else:
+                replay.Run(pipeWrapper, OnFrame)
+            return
         
         i = 0
         while 1:
@@ -161,6 +419,14 @@ def main():
                 sys.stdout.write("%d\r" % i)
                 sys.stdout.flush()
                 pipeWrapper.WriteRecord(dataFrm, channel)
+                OnFrame(dataFrm, channel)
+            else:
+                if (ringBaseName is not None):
+                    pipeWrapper.Poll()
+                if not analysis is None:
+                    analysis.Flush()
+                if not survey is None:
+                    CheckSurveyRequest()
 
             lock = not scan or (i > 0 and scanLock)
             if (not lock):
@@ -172,7 +438,11 @@ def main():
                     channel += 1
                     if (channel > 26):
                         channel = 11
+                        if not survey is None:
+                            analysis.ExportSurvey(surveyBaseName)
                     snifferAdapter.ChangeLogicalChannel(channel)
+                    if not analysis is None:
+                        analysis.ChangeChannel()
                     print "Changed to channel %d" % channel
                 
     except SerialException, err:
@@ -180,16 +450,39 @@ def main():
         sys.stderr.flush();
         #traceback.print_exc()
 
+    except IOError, err:
+        # export file write errors
+        sys.stderr.write('ERROR: %s\n' % str(err))
+        sys.stderr.flush();
+
     # For now: assume pipe closed
     except Exception, err:
         if not pipeWrapper is None:
             print "Pipe '%s' closed by Wireshark" % (pipeWrapper.getPipeName())
-            pipeWrapper.ClosePipe()
 
     except KeyboardInterrupt:
         if not pipeWrapper is None:
             print " Caught"
-            pipeWrapper.ClosePipe()
+
+    finally:
+        if not pipeWrapper is None:
+            try:
+                pipeWrapper.ClosePipe()
+            except IOError, err:
+                sys.stderr.write('ERROR: %s\n' % str(err))
+                sys.stderr.flush();
+        if not replay is None:
+            print replay.getReport()
+        if not analysis is None:
+            analysis.Close()
+        if not survey is None:
+            survey.Export(surveyBaseName)
+        if not lossEstimator is None:
+            lossEstimator.Close()
+            print lossEstimator.getReport()
+        if not profiler is None:
+            profiler.WriteReport(profileFile)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # worker processes in py2exe executables
     main()
@@ -0,0 +1,57 @@
+###############################################################################
+#
+# Description :
+#    Regression tests for the pre-trigger ring buffer.
+#    Run with: python -m unittest test_WS_SnifferTriggerRing
+#
+###############################################################################
+
+import unittest
+from WS_SnifferTriggerRing import cWS_SnifferRingBuffer
+
+def MakeBinFrm(seq, n):
+    """ a ZTC frame of n bytes, opcode group/opcode/length followed by the payload """
+    return chr(0x86) + chr(0x03) + chr(n - 3) + chr(seq) * (n - 3)
+
+class cRingBufferTest(unittest.TestCase):
+    def checkRecords(self, ring, expected):
+        records = ring.getRecords()
+        self.assertEqual([ord(frm.getBinFrm()[3]) for frm, channel in records], expected)
+        for frm, channel in records:
+            binFrm = frm.getBinFrm()
+            self.assertEqual(ord(binFrm[2]), len(binFrm) - 3)
+            self.assertEqual(binFrm[3:], binFrm[3] * (len(binFrm) - 3))
+
+    def testWrapKeepsNewestRecordsIntact(self):
+        ring = cWS_SnifferRingBuffer(100)
+        sizes = [10] * 10 + [25, 25, 25, 30]
+        for seq, n in enumerate(sizes):
+            ring.Add(MakeBinFrm(seq, n), 11, seq)
+        # 30 bytes do not fit behind the three 25 byte records: the ring
+        # wraps and only the newest records fitting in 100 bytes remain
+        self.checkRecords(ring, [12, 13])
+
+    def testRepeatedWraps(self):
+        ring = cWS_SnifferRingBuffer(100)
+        sizes = [10, 25, 7, 30, 12, 40, 9, 33, 18, 26] * 20
+        for seq, n in enumerate(sizes):
+            ring.Add(MakeBinFrm(seq % 256, n), 11, seq)
+            records = ring.getRecords()
+            self.assertTrue(sum(len(frm.getBinFrm()) for frm, channel in records) <= 100)
+            self.assertEqual(ord(records[-1][0].getBinFrm()[3]), seq % 256)
+            self.checkRecords(ring, [(seq - len(records) + 1 + k) % 256 for k in range(len(records))])
+
+    def testSmallFramesFillIndex(self):
+        ring = cWS_SnifferRingBuffer(480) # index for 10 records
+        for seq in range(30):
+            ring.Add(MakeBinFrm(seq, 14), 11, seq)
+        self.checkRecords(ring, range(20, 30))
+
+    def testMaxSeconds(self):
+        ring = cWS_SnifferRingBuffer(1000, 5)
+        for seq in range(20):
+            ring.Add(MakeBinFrm(seq, 20), 11, seq)
+        self.checkRecords(ring, range(14, 20))
+
+if __name__ == "__main__":
+    unittest.main()